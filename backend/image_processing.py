@@ -0,0 +1,48 @@
+"""
+CPU-bound image work for the upload pipeline.
+
+Runs inside the server's process pool, so this module only depends on
+Pillow: spawned workers import it without pulling in the app, the database
+client or the event loop.
+"""
+import io
+import warnings
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+
+# Pillow warns above MAX_IMAGE_PIXELS and only raises above twice that;
+# render_variants turns the warning into an error, so anything over 60M
+# pixels is refused before it can exhaust a worker's memory
+Image.MAX_IMAGE_PIXELS = 60_000_000
+
+
+def _encode(image: Image.Image, quality: int) -> Tuple[bytes, str]:
+    out = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image.convert("RGBA").save(out, format="PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    image.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue(), "image/jpeg"
+
+
+def render_variants(data: bytes, sizes: Dict[str, int], quality: int) -> Dict[str, Tuple[bytes, str]]:
+    """
+    Re-encode an image once per requested size: {name: max side in pixels}.
+    EXIF orientation is applied and metadata (GPS included) is dropped.
+    Raises DecompressionBombWarning for images over MAX_IMAGE_PIXELS.
+    Returns {name: (bytes, content type)}.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        with Image.open(io.BytesIO(data)) as source:
+            source.draft("RGB", (max(sizes.values()),) * 2)
+            image = ImageOps.exif_transpose(source)
+            image.load()
+
+    variants = {}
+    # Largest first, so each smaller variant resamples the previous one
+    for name, max_side in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        variants[name] = _encode(image, quality)
+    return variants
@@ -0,0 +1,50 @@
+"""
+Maintenance jobs for the backend database.
+
+Runs the same routines the admin maintenance endpoints expose, against the
+database configured in backend/.env, without going through the API.
+
+Usage: python maintenance.py <job> [<job> ...]
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from server import (
+    client,
+    expire_subscriptions,
+    migrate_verification_images,
+    rebuild_unread_counters,
+    rebuild_user_ratings,
+    reconcile_platform_stats,
+)
+
+JOBS = {
+    "rebuild-unread-counters": rebuild_unread_counters,
+    "migrate-verification-images": migrate_verification_images,
+    "reconcile-platform-stats": reconcile_platform_stats,
+    "rebuild-ratings": rebuild_user_ratings,
+    "expire-subscriptions": expire_subscriptions,
+}
+
+
+async def run(jobs):
+    try:
+        for name in jobs:
+            result = await JOBS[name]()
+            print(f"{name}: {json.dumps(result, default=str)}")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run backend maintenance jobs")
+    parser.add_argument("jobs", nargs="+", choices=sorted(JOBS), help="jobs to run, in order")
+    args = parser.parse_args()
+    asyncio.run(run(args.jobs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
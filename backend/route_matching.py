@@ -0,0 +1,162 @@
+"""
+Geometry for matching transport requests to a transporter's planned route.
+
+Coordinates come in as GeoJSON order, (longitude, latitude) in degrees.
+Distances are computed on a local equirectangular projection centred on the
+route, which is accurate to well under 1% at the scale of a road trip and
+lets every candidate be scored with a handful of vectorized numpy operations.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+# Rows of candidates scored per batch; bounds the (rows x segments) matrices
+SCORE_BATCH_ROWS = 4096
+
+
+def _projector(route: np.ndarray):
+    lat0 = np.radians(route[:, 1].mean())
+    scale = np.array([KM_PER_DEGREE * np.cos(lat0), KM_PER_DEGREE])
+    return lambda points: points * scale
+
+
+def simplify_route(route: np.ndarray, tolerance_km: float, max_points: int) -> np.ndarray:
+    """
+    Ramer-Douglas-Peucker simplification of a (n, 2) lon/lat polyline, then
+    uniform thinning if it still has more than max_points vertices.
+    """
+    if len(route) <= 2:
+        return route
+    xy = _projector(route)(route)
+    keep = np.zeros(len(route), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(route) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner = xy[first + 1:last]
+        distances = np.sqrt(_point_segment_distances(inner, xy[first:first + 1], xy[last:last + 1])[0][:, 0])
+        index = int(distances.argmax())
+        if distances[index] > tolerance_km:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    simplified = route[keep]
+    if len(simplified) > max_points:
+        simplified = simplified[np.linspace(0, len(simplified) - 1, max_points).round().astype(int)]
+    return simplified
+
+
+def corridor_polygons(route: np.ndarray, width_km: float, max_boxes: int = 200) -> List[list]:
+    """
+    Cover the route buffered by width_km with lon/lat boxes, one per piece of
+    route, as GeoJSON MultiPolygon coordinates. Long segments are cut into
+    pieces so the boxes hug diagonal stretches instead of covering their
+    whole bounding rectangle. The cover is a superset of the corridor, for
+    index prefiltering only.
+    """
+    xy = _projector(route)(route)
+    lengths = np.hypot(*np.diff(xy, axis=0).T)
+    piece_km = max(4 * width_km, lengths.sum() / max_boxes)
+
+    points = [route[:1]]
+    for start, end, length in zip(route[:-1], route[1:], lengths):
+        pieces = max(1, int(np.ceil(length / piece_km)))
+        points.append(start + np.outer(np.arange(1, pieces + 1) / pieces, end - start))
+    points = np.concatenate(points)
+
+    # 10% margin for the great-circle edges of the boxes
+    margin_lat = 1.1 * width_km / KM_PER_DEGREE
+    polygons = []
+    for start, end in zip(points[:-1], points[1:]):
+        min_lat = max(-89.0, min(start[1], end[1]) - margin_lat)
+        max_lat = min(89.0, max(start[1], end[1]) + margin_lat)
+        margin_lon = margin_lat / np.cos(np.radians(max(abs(min_lat), abs(max_lat))))
+        min_lon = max(-180.0, min(start[0], end[0]) - margin_lon)
+        max_lon = min(180.0, max(start[0], end[0]) + margin_lon)
+        polygons.append([[
+            [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+        ]])
+    return polygons
+
+
+def _point_segment_distances(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Squared distance from every point (m, 2) to every segment (k, 2)->(k, 2),
+    and the position of the closest point as a fraction of each segment;
+    both (m, k). Expanded as |o|^2 - t(2 o.d - t|d|^2) on separate x/y
+    planes, which keeps every temporary a plain (m, k) array.
+    """
+    dx, dy = (ends - starts).T
+    length_sq = dx * dx + dy * dy
+    length_sq[length_sq == 0] = 1e-12
+    ox = points[:, :1] - starts[:, 0]
+    oy = points[:, 1:] - starts[:, 1]
+    projection = ox * dx + oy * dy
+    t = np.clip(projection / length_sq, 0.0, 1.0)
+    distance_sq = ox * ox + oy * oy - t * (2 * projection - t * length_sq)
+    return np.maximum(distance_sq, 0.0), t
+
+
+def _locate(points: np.ndarray, starts: np.ndarray, ends: np.ndarray, cumulative: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distance to the route and position along it (km from the start) of each point"""
+    distance_sq, t = _point_segment_distances(points, starts, ends)
+    segment = distance_sq.argmin(axis=1)
+    rows = np.arange(len(points))
+    segment_lengths = cumulative[1:] - cumulative[:-1]
+    along = cumulative[segment] + t[rows, segment] * segment_lengths[segment]
+    return np.sqrt(distance_sq[rows, segment]), along
+
+
+def score_candidates(route: np.ndarray, pickups: np.ndarray, dropoffs: np.ndarray, max_detour_km: float) -> dict:
+    """
+    Score pickup/drop-off pairs (each (m, 2) lon/lat) against the route.
+
+    A request fits when both ends are within max_detour_km of the route, the
+    pickup comes before the drop-off in the direction of travel, and the
+    estimated detour is within budget. The detour is leaving the route at the
+    point nearest the pickup, driving pickup -> drop-off, rejoining at the
+    point nearest the drop-off, minus the stretch of route skipped:
+
+        detour = d(route, P) + |P D| + d(route, D) - (along(D) - along(P))
+
+    Returns index arrays into the candidates plus their detour, pickup and
+    drop-off distances (km), sorted by detour.
+    """
+    project = _projector(route)
+    xy = project(route)
+    starts, ends = xy[:-1], xy[1:]
+    cumulative = np.concatenate([[0.0], np.cumsum(np.hypot(*(ends - starts).T))])
+    pickups, dropoffs = project(pickups), project(dropoffs)
+
+    pickup_km = np.empty(len(pickups))
+    dropoff_km = np.empty(len(pickups))
+    pickup_along = np.empty(len(pickups))
+    dropoff_along = np.empty(len(pickups))
+    for first in range(0, len(pickups), SCORE_BATCH_ROWS):
+        batch = slice(first, first + SCORE_BATCH_ROWS)
+        pickup_km[batch], pickup_along[batch] = _locate(pickups[batch], starts, ends, cumulative)
+        dropoff_km[batch], dropoff_along[batch] = _locate(dropoffs[batch], starts, ends, cumulative)
+
+    direct_km = np.hypot(*(dropoffs - pickups).T)
+    detour_km = np.maximum(0.0, pickup_km + direct_km + dropoff_km - (dropoff_along - pickup_along))
+
+    fits = (
+        (pickup_km <= max_detour_km)
+        & (dropoff_km <= max_detour_km)
+        & (pickup_along <= dropoff_along)
+        & (detour_km <= max_detour_km)
+    )
+    index = np.flatnonzero(fits)
+    index = index[np.argsort(detour_km[index], kind="stable")]
+    return {
+        "index": index,
+        "detour_km": detour_km[index],
+        "pickup_km": pickup_km[index],
+        "dropoff_km": dropoff_km[index],
+    }
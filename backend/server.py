@@ -1,19 +1,38 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, Query, Form, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import IndexModel, UpdateOne, UpdateMany, ReturnDocument, ASCENDING, DESCENDING, GEOSPHERE, TEXT
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 import os
+import time
+import asyncio
 import logging
 import re
+import json
 import base64
+import binascii
+import hashlib
+import hmac
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, field_validator
+from typing import List, Optional, Dict, Tuple, Union
 import uuid
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import bcrypt
 import jwt
+from cachetools import LRUCache, TTLCache
+from image_processing import render_variants
+from route_matching import simplify_route, corridor_polygons, score_candidates
+import numpy as np
+try:
+    import orjson
+except ImportError:  # optional, only needed for FAST_JSON_RESPONSES
+    orjson = None
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 
 ROOT_DIR = Path(__file__).parent
@@ -31,13 +50,91 @@ if not JWT_SECRET:
     logger.warning("JWT_SECRET not set, using insecure default - DO NOT USE IN PRODUCTION")
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
+# Credentials that have to travel in URLs (<img>, EventSource, WebSocket)
+# are short-lived and scoped instead of the session JWT
+SIGNED_BLOB_URL_SECONDS = int(os.environ.get('SIGNED_BLOB_URL_SECONDS', '300'))
+STREAM_TICKET_SECONDS = int(os.environ.get('STREAM_TICKET_SECONDS', '60'))
+
+# Authenticated-user cache (per process)
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+
+# Notification outbox: writes are batched per size or age
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100'))
+NOTIFICATION_FLUSH_SECONDS = float(os.environ.get('NOTIFICATION_FLUSH_SECONDS', '0.2'))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '8'))
+
+# Admin platform stats: full recount interval
+PLATFORM_STATS_RECONCILE_SECONDS = int(os.environ.get('PLATFORM_STATS_RECONCILE_SECONDS', '3600'))
+
+# Dashboard stats cache (per process)
+STATS_CACHE_TTL_SECONDS = int(os.environ.get('STATS_CACHE_TTL_SECONDS', '5'))
+
+# Password hashing pool: bcrypt runs off the event loop on a bounded executor
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', '32'))
 
 # Stripe Configuration
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', '')
+# Non-final checkout statuses are re-read from Stripe at most this often
+CHECKOUT_STATUS_CACHE_TTL_SECONDS = int(os.environ.get('CHECKOUT_STATUS_CACHE_TTL_SECONDS', '4'))
+# Webhook events are processed by a background worker: a claimed event is
+# leased for STRIPE_EVENT_LEASE_SECONDS and retried with backoff until
+# STRIPE_EVENT_MAX_ATTEMPTS
+STRIPE_EVENT_LEASE_SECONDS = int(os.environ.get('STRIPE_EVENT_LEASE_SECONDS', '60'))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', '8'))
+STRIPE_EVENT_POLL_SECONDS = int(os.environ.get('STRIPE_EVENT_POLL_SECONDS', '5'))
 
 # Payment Plans
 SUBSCRIPTION_PRICE = 3.99  # Monthly subscription for transporters in EUR
 SUBSCRIPTION_CURRENCY = "eur"
+# When true, transporter endpoints (offers, request browsing) need an active subscription
+REQUIRE_SUBSCRIPTION = os.environ.get('REQUIRE_SUBSCRIPTION', 'false').lower() in ('1', 'true', 'yes')
+ENTITLEMENT_CACHE_TTL_SECONDS = int(os.environ.get('ENTITLEMENT_CACHE_TTL_SECONDS', '30'))
+SUBSCRIPTION_SWEEP_SECONDS = int(os.environ.get('SUBSCRIPTION_SWEEP_SECONDS', '300'))
+
+# Blob storage (GridFS)
+BLOB_CHUNK_BYTES = int(os.environ.get('BLOB_CHUNK_BYTES', str(255 * 1024)))
+
+# Uploads: per-file limit, and per-request limit checked against Content-Length
+# before the multipart body is read. JSON bodies carry the same images in
+# base64, a third larger
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(5 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get('UPLOAD_MAX_REQUEST_BYTES', str(4 * UPLOAD_MAX_BYTES + 64 * 1024)))
+UPLOAD_MAX_JSON_BYTES = int(os.environ.get('UPLOAD_MAX_JSON_BYTES', str(UPLOAD_MAX_REQUEST_BYTES * 4 // 3)))
+
+# Image pipeline: uploads are re-encoded in the background into capped
+# variants; originals are kept untouched for audit
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '2048'))
+IMAGE_THUMB_DIMENSION = int(os.environ.get('IMAGE_THUMB_DIMENSION', '320'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+IMAGE_VARIANT_SIZES = {"display": IMAGE_MAX_DIMENSION, "thumb": IMAGE_THUMB_DIMENSION}
+
+# Geo search
+NEARBY_DEFAULT_RADIUS_KM = float(os.environ.get('NEARBY_DEFAULT_RADIUS_KM', '50'))
+NEARBY_MAX_RADIUS_KM = float(os.environ.get('NEARBY_MAX_RADIUS_KM', '500'))
+
+# Route matching: routes are simplified to at most ROUTE_MAX_POINTS vertices
+# and at most ROUTE_MATCH_MAX_CANDIDATES corridor hits are scored per query
+ROUTE_MAX_POINTS = int(os.environ.get('ROUTE_MAX_POINTS', '200'))
+ROUTE_MATCH_MAX_CANDIDATES = int(os.environ.get('ROUTE_MATCH_MAX_CANDIDATES', '20000'))
+ROUTE_MAX_DETOUR_KM = float(os.environ.get('ROUTE_MAX_DETOUR_KM', '200'))
+
+# Pagination
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '100'))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Set to "true" when a search scored only part of the matching requests
+RESULTS_TRUNCATED_HEADER = "X-Results-Truncated"
+
+# List endpoints: serialize Mongo rows straight to JSON with orjson instead of
+# validating each one against the response model (needs orjson installed)
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', 'false').lower() in ('1', 'true', 'yes')
+
+# Server-Sent Events
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_REPLAY_LIMIT = 50
 
 security = HTTPBearer(auto_error=False)
 
@@ -86,11 +183,32 @@ async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(sec
         raise HTTPException(status_code=403, detail="Se requiere rol de administrador")
     return user
 
+class GeoPoint(BaseModel):
+    """GeoJSON point; coordinates are [longitud, latitud]"""
+    type: str = "Point"
+    coordinates: List[float]
+
+    @field_validator("type")
+    @classmethod
+    def check_type(cls, value: str) -> str:
+        if value != "Point":
+            raise ValueError("Solo se admiten puntos GeoJSON")
+        return value
+
+    @field_validator("coordinates")
+    @classmethod
+    def check_coordinates(cls, value: List[float]) -> List[float]:
+        if len(value) != 2 or not -180 <= value[0] <= 180 or not -90 <= value[1] <= 90:
+            raise ValueError("Coordenadas no válidas, se espera [longitud, latitud]")
+        return value
+
 class TransportRequestCreate(BaseModel):
     titulo: str
     descripcion: str
     origen: str
     destino: str
+    origen_geo: Optional[GeoPoint] = None
+    destino_geo: Optional[GeoPoint] = None
     tipo_carga: str
     precio_ofrecido: float
 
@@ -103,11 +221,43 @@ class TransportRequest(BaseModel):
     descripcion: str
     origen: str
     destino: str
+    origen_geo: Optional[GeoPoint] = None
+    destino_geo: Optional[GeoPoint] = None
     tipo_carga: str
     precio_ofrecido: float
     estado: str  # abierto, en_negociacion, aceptado, en_transito, completado, cancelado
     created_at: str
 
+class NearbyTransportRequest(TransportRequest):
+    distancia_km: float
+
+class SearchTransportRequest(TransportRequest):
+    relevancia: float
+
+class RouteMatchQuery(BaseModel):
+    """A planned trip: either a polyline of [longitud, latitud] points or an origin/destination pair"""
+    ruta: Optional[List[List[float]]] = None
+    origen: Optional[GeoPoint] = None
+    destino: Optional[GeoPoint] = None
+    desvio_km: float = Field(20.0, gt=0)
+    tipo_carga: Optional[str] = None
+    limit: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+
+    @field_validator("ruta")
+    @classmethod
+    def check_route(cls, value: Optional[List[List[float]]]) -> Optional[List[List[float]]]:
+        if value is not None:
+            if len(value) < 2:
+                raise ValueError("La ruta necesita al menos dos puntos")
+            for point in value:
+                GeoPoint(coordinates=point)
+        return value
+
+class RouteMatch(TransportRequest):
+    desvio_km: float  # estimated extra distance to serve the request
+    recogida_km: float  # distance from the route to the pickup
+    entrega_km: float  # distance from the route to the drop-off
+
 class OfferCreate(BaseModel):
     solicitud_id: str
     precio_oferta: float
@@ -195,8 +345,9 @@ class IdentityVerification(BaseModel):
     user_id: str
     tipo_documento: str  # dni, pasaporte, etc
     numero_documento: str
-    documento_imagen: str  # base64
+    documento_imagen: Optional[str] = None  # legacy base64, see blobs
     selfie_imagen: Optional[str] = None
+    blobs: Dict[str, str] = {}  # image field -> blob id
     status: str  # pending, approved, rejected
     admin_notes: Optional[str] = None
     created_at: str
@@ -211,10 +362,11 @@ class VehicleVerification(BaseModel):
     modelo: str
     ano: int
     matricula: str
-    foto_vehiculo: str  # base64
-    foto_matricula: str  # base64
-    permiso_circulacion: Optional[str] = None  # base64
-    seguro_imagen: Optional[str] = None  # base64
+    foto_vehiculo: Optional[str] = None  # legacy base64, see blobs
+    foto_matricula: Optional[str] = None
+    permiso_circulacion: Optional[str] = None
+    seguro_imagen: Optional[str] = None
+    blobs: Dict[str, str] = {}  # image field -> blob id
     status: str  # pending, approved, rejected
     admin_notes: Optional[str] = None
     created_at: str
@@ -229,62 +381,230 @@ class Notification(BaseModel):
     mensaje: str
     link: Optional[str] = None
     leida: bool = False
+    count: int = 1  # events folded into this notification
     created_at: str
 
 # ============ CHAT FILTER UTILITIES ============
 
+# Every contact rule starts with a character from a small set (h, @, +,
+# digits and the first letters of the social keywords). The combined pattern
+# consumes that first character with a single character class, which lets
+# the regex engine skip all other positions in C, and then dispatches on it
+# with one-character lookbehinds. The message is scanned once, left to
+# right; no rule can restart inside a run it already rejected, so the scan
+# stays linear on long digit runs and long words.
+#
+# Emails are anchored on "@": the local part is recovered by walking back
+# over the run of local-part characters. Precedence follows the old
+# phones, then emails, then social keywords order; the remaining known
+# differences from the old filter are listed in tests/bench_contact_filter.py.
+_PHONE_TAIL = r'[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}[-.\s]?\d{0,4}'
+_CONTACT_RULES = [
+    # (group name, pattern after the first character, reason, placeholder)
+    ("url", r'(?<=h)ttps?://[^\s]+', 'enlace', '[ENLACE OCULTO]'),
+    ("at", r'(?<=@)', None, None),
+    ("phone_run", r'(?<=\d)(?<!\d\d)\d{8,}', 'número de teléfono', '[NÚMERO OCULTO]'),
+    # Also covers the old ddd-ddd-ddd(d) pattern, which is a subset of this one
+    ("phone", r'(?:(?<=\+)\d{1,3}|(?<=\d)\d{0,2})' + _PHONE_TAIL, 'número de teléfono', '[NÚMERO OCULTO]'),
+    # Social rules mark where the handle starts with an empty <name>_tail group
+    ("instagram", r'(?<=[iIİı])(?i:nstagram|g|nsta)[\s:]*(?P<instagram_tail>)[a-zA-Z0-9._]+', 'Instagram', '[INSTAGRAM OCULTO]'),
+    ("whatsapp", r'(?<=[wW])(?i:hatsapp|sp|hats)[\s:]*(?P<whatsapp_tail>)[\d+]+', 'WhatsApp', '[WHATSAPP OCULTO]'),
+    ("telegram", r'(?<=[tT])(?i:elegram|g)[\s:]*(?P<telegram_tail>)[a-zA-Z0-9_]+', 'Telegram', '[TELEGRAM OCULTO]'),
+    ("facebook", r'(?<=[fF])(?i:acebook|b)[\s:./]*(?P<facebook_tail>)[a-zA-Z0-9.]+', 'Facebook', '[FACEBOOK OCULTO]'),
+    ("twitter", r'(?<=[tT])(?i:witter|w)[\s:./]*(?P<twitter_tail>)[a-zA-Z0-9_]+', 'Twitter', '[TWITTER OCULTO]'),
+]
+_CONTACT_PATTERN = re.compile(
+    r'[h@+\diIİıwWtTfF](?:' + '|'.join(f'{pattern}(?P<{name}>)' for name, pattern, _, _ in _CONTACT_RULES) + ')'
+)
+_EMAIL_DOMAIN = re.compile(r'@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+# A social keyword followed directly by a phone number ("whatsapp 600123123")
+# keeps the keyword and hides the number, as the old phones-first order did
+_PHONE_AT = re.compile(r'\+?\d{1,3}' + _PHONE_TAIL + r'|\d{9,}')
+_PHONE_START_CHARS = frozenset('+0123456789')
+_SOCIAL_RULES = frozenset(("instagram", "whatsapp", "telegram", "facebook", "twitter"))
+_SOCIAL_HANDLE = re.compile(r'@[a-zA-Z0-9_]{3,}')
+_EMAIL_LOCAL_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-')
+
+_CONTACT_REPLACEMENTS = {name: (reason, placeholder) for name, _, reason, placeholder in _CONTACT_RULES}
+_CONTACT_REPLACEMENTS["email"] = ('email', '[EMAIL OCULTO]')
+_CONTACT_REPLACEMENTS["handle"] = ('usuario de red social', '[USUARIO DE RED SOCIAL OCULTO]')
+
+def _match_at_sign(text: str, at: int, spans: list) -> Optional[tuple]:
+    """Resolve an "@" into an email or social handle span, or None"""
+    domain = _EMAIL_DOMAIN.match(text, at)
+    if domain:
+        local = at
+        while local > 0 and text[local - 1] in _EMAIL_LOCAL_CHARS:
+            local -= 1
+        # The old filter hid phone numbers first, then emails, then social
+        # keywords: a keyword match reaching into the local part gives way
+        # to the email ("ig: juan@gmail.com" -> "ig: [EMAIL OCULTO]"), while
+        # a phone number there cuts the local part short
+        while spans and spans[-1][1] > local:
+            if spans[-1][2] in ("phone", "phone_run"):
+                local = spans[-1][1]
+                break
+            spans.pop()
+        if local < at:
+            return local, domain.end(), "email"
+    
+    handle = _SOCIAL_HANDLE.match(text, at)
+    if handle:
+        return at, handle.end(), "handle"
+    return None
+
 def filter_external_contact(text: str) -> tuple:
     """
     Filter messages to prevent sharing external contact info.
     Returns (filtered_text, was_blocked, reason)
     """
-    original = text
-    blocked = False
-    reasons = []
-    
-    # Phone patterns (various formats)
-    phone_patterns = [
-        r'\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}[-.\s]?\d{0,4}',
-        r'\d{9,}',
-        r'\d{3}[-.\s]\d{3}[-.\s]\d{3,4}',
-    ]
-    for pattern in phone_patterns:
-        if re.search(pattern, text):
-            text = re.sub(pattern, '[NÚMERO OCULTO]', text)
-            blocked = True
-            reasons.append('número de teléfono')
-    
-    # Email patterns
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    if re.search(email_pattern, text):
-        text = re.sub(email_pattern, '[EMAIL OCULTO]', text)
-        blocked = True
-        reasons.append('email')
-    
-    # Social media patterns
-    social_patterns = [
-        (r'@[a-zA-Z0-9_]{3,}', 'usuario de red social'),
-        (r'(?:instagram|ig|insta)[\s:]*[a-zA-Z0-9._]+', 'Instagram'),
-        (r'(?:whatsapp|wsp|whats)[\s:]*[\d+]+', 'WhatsApp'),
-        (r'(?:telegram|tg)[\s:]*[a-zA-Z0-9_]+', 'Telegram'),
-        (r'(?:facebook|fb)[\s:./]*[a-zA-Z0-9.]+', 'Facebook'),
-        (r'(?:twitter|tw)[\s:./]*[a-zA-Z0-9_]+', 'Twitter'),
-    ]
-    for pattern, name in social_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            text = re.sub(pattern, f'[{name.upper()} OCULTO]', text, flags=re.IGNORECASE)
-            blocked = True
-            reasons.append(name)
-    
-    # URL patterns
-    url_pattern = r'https?://[^\s]+'
-    if re.search(url_pattern, text):
-        text = re.sub(url_pattern, '[ENLACE OCULTO]', text)
-        blocked = True
-        reasons.append('enlace')
-    
-    reason = ', '.join(set(reasons)) if reasons else None
-    return text, blocked, reason
+    spans = []
+    pos = 0
+    while True:
+        match = _CONTACT_PATTERN.search(text, pos)
+        if match is None:
+            break
+        if match.lastgroup == "at":
+            span = _match_at_sign(text, match.start(), spans)
+            if span is None:
+                pos = match.end()
+                continue
+        elif match.lastgroup in _SOCIAL_RULES:
+            tail = match.start(match.lastgroup + "_tail")
+            if text[tail] in _PHONE_START_CHARS and _PHONE_AT.match(text, tail):
+                pos = tail
+                continue
+            span = (match.start(), match.end(), match.lastgroup)
+        else:
+            span = (match.start(), match.end(), match.lastgroup)
+        spans.append(span)
+        pos = span[1]
+    
+    if not spans:
+        return text, False, None
+    
+    parts = []
+    reasons = {}
+    last = 0
+    for start, end, name in spans:
+        reason, placeholder = _CONTACT_REPLACEMENTS[name]
+        reasons[reason] = None
+        parts.append(text[last:start])
+        parts.append(placeholder)
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts), True, ', '.join(reasons)
+
+# ============ PAGINATION UTILITIES ============
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of the last returned document as an opaque cursor"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode a cursor produced by encode_cursor, raising 400 when malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+def keyset_after(cursor: Optional[str]) -> dict:
+    """
+    Query fragment selecting documents strictly after the cursor position in
+    (created_at desc, id desc) order. Served from a (..., created_at, id)
+    index, so every page costs the same regardless of depth.
+    """
+    if not cursor:
+        return {}
+    created_at, doc_id = decode_cursor(cursor, 2)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}},
+    ]}
+
+async def fetch_page(collection, query: dict, limit: int, response: Response, projection: Optional[dict] = None) -> list:
+    """
+    Read one keyset page ordered by (created_at desc, id desc). Fetches one
+    extra document to know whether a next page exists and, if so, returns its
+    cursor in the X-Next-Cursor response header.
+    """
+    docs = await collection.find(
+        query,
+        projection or {"_id": 0}
+    ).sort([("created_at", DESCENDING), ("id", DESCENDING)]).limit(limit + 1).to_list(limit + 1)
+
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1]["created_at"], docs[-1]["id"])
+    return docs
+
+def model_projection(model) -> dict:
+    """Mongo projection returning exactly the fields of a response model"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def model_defaults(model) -> dict:
+    """Defaults of a response model's optional fields, as validation would fill them in"""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+# model_defaults per response model, filled on first use
+response_model_defaults: Dict[type, dict] = {}
+
+def json_rows(rows: list, model, response: Optional[Response] = None):
+    """
+    Return rows for a list endpoint. By default FastAPI validates them
+    against the endpoint's response_model; with FAST_JSON_RESPONSES they go
+    out through orjson, so the rows must come from a model_projection query
+    of the same model. Optional fields missing from a document are filled
+    with the model default, so both paths send the same keys. A returned
+    Response replaces the injected one, so its headers (the next-page
+    cursor) are passed on explicitly.
+    """
+    if not FAST_JSON_RESPONSES or orjson is None:
+        return rows
+    defaults = response_model_defaults.get(model)
+    if defaults is None:
+        defaults = response_model_defaults[model] = model_defaults(model)
+    if defaults:
+        rows = [row if defaults.keys() <= row.keys() else {**defaults, **row} for row in rows]
+    headers = {}
+    if response is not None and NEXT_CURSOR_HEADER in response.headers:
+        headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+    return ORJSONResponse(rows, headers=headers)
+
+TRANSPORT_REQUEST_PROJECTION = model_projection(TransportRequest)
+OFFER_PROJECTION = model_projection(Offer)
+RATING_PROJECTION = model_projection(Rating)
+
+# ============ METRICS ============
+
+# Per-process latency aggregates, served by /admin/metrics
+latency_metrics: Dict[str, dict] = {}
+
+def record_latency(name: str, seconds: float):
+    metric = latency_metrics.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    ms = seconds * 1000
+    metric["count"] += 1
+    metric["total_ms"] += ms
+    metric["max_ms"] = max(metric["max_ms"], ms)
+
+def latency_summary() -> Dict[str, dict]:
+    return {
+        name: {
+            "count": m["count"],
+            "avg_ms": round(m["total_ms"] / m["count"], 3) if m["count"] else None,
+            "max_ms": round(m["max_ms"], 3),
+        }
+        for name, m in latency_metrics.items()
+    }
 
 # ============ AUTH UTILITIES ============
 
@@ -294,6 +614,37 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+# bcrypt releases the GIL, so a small thread pool gives real parallelism
+# without blocking the event loop. Work beyond BCRYPT_MAX_PENDING in flight
+# is refused with 503 instead of queueing unboundedly.
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+bcrypt_stats = {"pending": 0, "rejected": 0}
+
+async def run_bcrypt(fn, *args):
+    if bcrypt_stats["pending"] >= BCRYPT_MAX_PENDING:
+        bcrypt_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": "1"}
+        )
+    
+    def timed():
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, started, time.perf_counter()
+    
+    bcrypt_stats["pending"] += 1
+    submitted = time.perf_counter()
+    try:
+        result, started, finished = await asyncio.get_running_loop().run_in_executor(bcrypt_executor, timed)
+    finally:
+        bcrypt_stats["pending"] -= 1
+    
+    record_latency("bcrypt_queue_wait", started - submitted)
+    record_latency(f"bcrypt_{fn.__name__}", finished - started)
+    return result
+
 def create_token(user_id: str) -> str:
     payload = {
         'user_id': user_id,
@@ -301,19 +652,48 @@ def create_token(user_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# LRU + TTL cache of decoded User objects keyed by user id. Entries written
+# by this process are invalidated explicitly; changes made by other workers
+# become visible after at most USER_CACHE_TTL_SECONDS.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+user_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def invalidate_user_cache(user_id: str):
+    if user_cache.pop(user_id, None) is not None:
+        user_cache_stats["invalidations"] += 1
+
+async def load_user(user_id: str) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is not None:
+        user_cache_stats["hits"] += 1
+        return user
+    
+    user_cache_stats["misses"] += 1
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    if not user_doc:
+        return None
+    user = User(**user_doc)
+    user_cache[user_id] = user
+    return user
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if credentials is None:
         raise HTTPException(status_code=401, detail="No se proporcionó token de autenticación")
+    return await get_user_from_token(credentials.credentials)
+
+async def get_user_from_token(token: Optional[str]) -> User:
+    """Resolve a JWT to its user; used directly where no Authorization header is available (WebSocket)"""
+    if not token:
+        raise HTTPException(status_code=401, detail="No se proporcionó token de autenticación")
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get('user_id')
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await load_user(user_id)
         if not user:
             raise HTTPException(status_code=401, detail="Usuario no encontrado")
         
-        return User(**user)
+        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expirado")
     except HTTPException:
@@ -321,6 +701,72 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except Exception as e:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+def create_stream_ticket(user_id: str) -> str:
+    payload = {
+        'user_id': user_id,
+        'scope': 'stream',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=STREAM_TICKET_SECONDS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+async def get_user_from_stream_ticket(ticket: Optional[str]) -> User:
+    """
+    Resolve a stream ticket (see /auth/stream-ticket) to its user. Used by
+    the SSE and WebSocket endpoints, which cannot send an Authorization
+    header; the ticket only opens streams and expires within a minute, so
+    one leaked through a log or the browser history is of little use.
+    """
+    if not ticket:
+        raise HTTPException(status_code=401, detail="No se proporcionó token de autenticación")
+    try:
+        payload = jwt.decode(ticket, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expirado")
+    except Exception:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    if payload.get('scope') != 'stream':
+        raise HTTPException(status_code=401, detail="Token inválido")
+    user = await load_user(payload.get('user_id'))
+    if not user:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
+    return user
+
+# ============ SUBSCRIPTION ENTITLEMENT ============
+
+# Per-process cache of each user's active subscription end date. Entries
+# hold the end date rather than a yes/no, so a subscription stops counting
+# the moment it ends even while its entry is cached. "No subscription" is
+# never cached: activation may happen in another worker, and a transporter
+# coming back from checkout must be let in right away.
+entitlement_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=ENTITLEMENT_CACHE_TTL_SECONDS)
+entitlement_cache_stats = {"hits": 0, "misses": 0}
+
+async def is_entitled(user_id: str) -> bool:
+    now = datetime.now(timezone.utc).isoformat()
+    end_date = entitlement_cache.get(user_id)
+    if end_date is not None and end_date > now:
+        entitlement_cache_stats["hits"] += 1
+        return True
+    
+    entitlement_cache_stats["misses"] += 1
+    subscription = await db.subscriptions.find_one(
+        {"user_id": user_id, "status": "active", "end_date": {"$gt": now}},
+        {"_id": 0, "end_date": 1},
+        sort=[("end_date", DESCENDING)]
+    )
+    if not subscription:
+        entitlement_cache.pop(user_id, None)
+        return False
+    entitlement_cache[user_id] = subscription["end_date"]
+    return True
+
+async def get_entitled_user(current_user: User = Depends(get_current_user)):
+    """get_current_user, plus an active subscription for transporters when REQUIRE_SUBSCRIPTION is on"""
+    if REQUIRE_SUBSCRIPTION and "transportista" in current_user.roles and "admin" not in current_user.roles:
+        if not await is_entitled(current_user.id):
+            raise HTTPException(status_code=402, detail="Necesitas una suscripción activa")
+    return current_user
+
 # ============ AUTH ROUTES ============
 
 @api_router.post("/auth/register")
@@ -338,19 +784,22 @@ async def register(user_data: UserRegister):
     
     # Create user
     user_id = str(uuid.uuid4())
+    password_hash = await run_bcrypt(hash_password, user_data.password)
     user_doc = {
         "id": user_id,
         "email": user_data.email,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": password_hash,
         "nombre": user_data.nombre,
         "telefono": user_data.telefono,
         "roles": user_data.roles,
         "rating": 0.0,
+        "rating_sum": 0.0,
         "num_ratings": 0,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.users.insert_one(user_doc)
+    await bump_platform_stats(total_users=1)
     
     token = create_token(user_id)
     user_response = {k: v for k, v in user_doc.items() if k not in ["password_hash", "_id"]}
@@ -366,7 +815,7 @@ async def login(credentials: UserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
-    if not verify_password(credentials.password, user["password_hash"]):
+    if not await run_bcrypt(verify_password, credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     
     token = create_token(user["id"])
@@ -377,6 +826,11 @@ async def login(credentials: UserLogin):
         "user": user_response
     }
 
+@api_router.post("/auth/stream-ticket")
+async def get_stream_ticket(current_user: User = Depends(get_current_user)):
+    """Short-lived ticket for opening the notification stream or a chat socket"""
+    return {"ticket": create_stream_ticket(current_user.id), "expires_in": STREAM_TICKET_SECONDS}
+
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
@@ -402,26 +856,222 @@ async def create_request(request_data: TransportRequestCreate, current_user: Use
         "estado": "abierto",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
+    # Only set when the client resolved coordinates, so the 2dsphere indexes
+    # skip requests without them
+    if request_data.origen_geo:
+        request_doc["origen_geo"] = request_data.origen_geo.model_dump()
+    if request_data.destino_geo:
+        request_doc["destino_geo"] = request_data.destino_geo.model_dump()
     
     await db.transport_requests.insert_one(request_doc)
+    await bump_platform_stats(total_requests=1)
+    invalidate_stats_cache(current_user.id)
     return TransportRequest(**{k: v for k, v in request_doc.items() if k != "_id"})
 
 @api_router.get("/requests", response_model=List[TransportRequest])
-async def get_requests(estado: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    query = {}
+async def get_requests(
+    response: Response,
+    estado: Optional[List[str]] = Query(None),
+    tipo_carga: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_entitled_user)
+):
+    """List requests newest first; pass X-Next-Cursor back as `cursor` for the next page"""
+    query = keyset_after(cursor)
     if estado:
-        query["estado"] = estado
+        query["estado"] = estado[0] if len(estado) == 1 else {"$in": estado}
+    if tipo_carga:
+        query["tipo_carga"] = tipo_carga
     
-    requests = await db.transport_requests.find(query, {"_id": 0}).sort("created_at", -1).limit(100).to_list(100)
-    return requests
+    requests = await fetch_page(db.transport_requests, query, limit, response, TRANSPORT_REQUEST_PROJECTION)
+    return json_rows(requests, TransportRequest, response)
 
 @api_router.get("/requests/my-requests", response_model=List[TransportRequest])
-async def get_my_requests(current_user: User = Depends(get_current_user)):
-    requests = await db.transport_requests.find(
-        {"cliente_id": current_user.id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(100).to_list(100)
-    return requests
+async def get_my_requests(
+    response: Response,
+    estado: Optional[List[str]] = Query(None),
+    tipo_carga: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    query = keyset_after(cursor)
+    query["cliente_id"] = current_user.id
+    if estado:
+        query["estado"] = estado[0] if len(estado) == 1 else {"$in": estado}
+    if tipo_carga:
+        query["tipo_carga"] = tipo_carga
+    
+    requests = await fetch_page(db.transport_requests, query, limit, response, TRANSPORT_REQUEST_PROJECTION)
+    return json_rows(requests, TransportRequest, response)
+
+@api_router.get("/requests/nearby", response_model=List[NearbyTransportRequest])
+async def get_nearby_requests(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(NEARBY_DEFAULT_RADIUS_KM, gt=0, le=NEARBY_MAX_RADIUS_KM),
+    punto: str = Query("origen", pattern="^(origen|destino)$"),
+    estado: Optional[List[str]] = Query(None),
+    tipo_carga: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_entitled_user)
+):
+    """
+    Requests whose origin (or destination, with punto=destino) lies within
+    radius_km of lat/lng, nearest first. Defaults to open and in-negotiation
+    requests. Served by $geoNear on the 2dsphere index.
+    """
+    estado = estado or ["abierto", "en_negociacion"]
+    query = {"estado": estado[0] if len(estado) == 1 else {"$in": estado}}
+    if tipo_carga:
+        query["tipo_carga"] = tipo_carga
+    
+    return await db.transport_requests.aggregate([
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": [lng, lat]},
+            "key": f"{punto}_geo",
+            "distanceField": "distancia_m",
+            "maxDistance": radius_km * 1000,
+            "query": query,
+            "spherical": True,
+        }},
+        {"$limit": limit},
+        {"$set": {"distancia_km": {"$round": [{"$divide": ["$distancia_m", 1000]}, 2]}}},
+        {"$project": {"_id": 0, "distancia_m": 0}},
+    ]).to_list(limit)
+
+@api_router.get("/requests/search", response_model=List[SearchTransportRequest])
+async def search_requests(
+    response: Response,
+    q: str = Query(..., min_length=2, max_length=200),
+    estado: Optional[List[str]] = Query(None),
+    tipo_carga: Optional[str] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_entitled_user)
+):
+    """
+    Full-text search over title, description, origin, destination and cargo
+    type, most relevant first. The Spanish text index stems words and ignores
+    accents and case. Pass X-Next-Cursor back as `cursor` for the next page.
+    """
+    query = {"$text": {"$search": q}}
+    if estado:
+        query["estado"] = estado[0] if len(estado) == 1 else {"$in": estado}
+    if tipo_carga:
+        query["tipo_carga"] = tipo_carga
+    if precio_min is not None or precio_max is not None:
+        query["precio_ofrecido"] = {}
+        if precio_min is not None:
+            query["precio_ofrecido"]["$gte"] = precio_min
+        if precio_max is not None:
+            query["precio_ofrecido"]["$lte"] = precio_max
+    
+    pipeline = [
+        {"$match": query},
+        {"$set": {"relevancia": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        # Keyset on (relevancia desc, created_at desc, id desc)
+        score, created_at, doc_id = decode_cursor(cursor, 3)
+        pipeline.append({"$match": {"$or": [
+            {"relevancia": {"$lt": score}},
+            {"relevancia": score, "created_at": {"$lt": created_at}},
+            {"relevancia": score, "created_at": created_at, "id": {"$lt": doc_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"relevancia": -1, "created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$project": {"_id": 0}},
+    ]
+    results = await db.transport_requests.aggregate(pipeline).to_list(limit + 1)
+    
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["relevancia"], last["created_at"], last["id"])
+    return results
+
+# Route match queries, and how many scored a truncated candidate set
+route_match_stats = {"queries": 0, "truncated": 0}
+
+@api_router.post("/requests/route-matches", response_model=List[RouteMatch])
+async def match_requests_to_route(query: RouteMatchQuery, response: Response, current_user: User = Depends(get_entitled_user)):
+    """
+    Open requests whose pickup and drop-off both lie within desvio_km of the
+    planned route, in travel order, ranked by estimated detour. Candidates
+    come from the 2dsphere indexes through a box cover of the corridor and
+    are then scored with vectorized point-to-segment distances. When more
+    than ROUTE_MATCH_MAX_CANDIDATES requests are in the corridor only that
+    many are scored and X-Results-Truncated is set: narrow the detour or
+    filter by tipo_carga for a complete ranking.
+    """
+    if "transportista" not in current_user.roles:
+        raise HTTPException(status_code=403, detail="Solo los transportistas pueden buscar cargas en ruta")
+    if query.desvio_km > ROUTE_MAX_DETOUR_KM:
+        raise HTTPException(status_code=400, detail=f"El desvío máximo es {ROUTE_MAX_DETOUR_KM:g} km")
+    if query.ruta:
+        route = np.array(query.ruta, dtype=float)
+    elif query.origen and query.destino:
+        route = np.array([query.origen.coordinates, query.destino.coordinates], dtype=float)
+    else:
+        raise HTTPException(status_code=400, detail="Indica una ruta o un origen y un destino")
+    
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    route = simplify_route(route, min(1.0, query.desvio_km / 4), ROUTE_MAX_POINTS)
+    corridor = {"$geoWithin": {"$geometry": {
+        "type": "MultiPolygon",
+        "coordinates": corridor_polygons(route, query.desvio_km),
+    }}}
+    candidate_query = {
+        "estado": {"$in": ["abierto", "en_negociacion"]},
+        "origen_geo": corridor,
+        "destino_geo": corridor,
+    }
+    if query.tipo_carga:
+        candidate_query["tipo_carga"] = query.tipo_carga
+    
+    # One extra to tell a corridor with exactly the cap from a truncated one
+    candidates = await db.transport_requests.find(
+        candidate_query,
+        {"_id": 0, "id": 1, "origen_geo.coordinates": 1, "destino_geo.coordinates": 1}
+    ).limit(ROUTE_MATCH_MAX_CANDIDATES + 1).to_list(ROUTE_MATCH_MAX_CANDIDATES + 1)
+    if len(candidates) > ROUTE_MATCH_MAX_CANDIDATES:
+        candidates = candidates[:ROUTE_MATCH_MAX_CANDIDATES]
+        response.headers[RESULTS_TRUNCATED_HEADER] = "true"
+        route_match_stats["truncated"] += 1
+        logger.warning(f"Route match hit the candidate cap ({ROUTE_MATCH_MAX_CANDIDATES}); results are incomplete")
+    route_match_stats["queries"] += 1
+    if not candidates:
+        record_latency("route_matches", time.perf_counter() - started)
+        return []
+    
+    pickups = np.array([c["origen_geo"]["coordinates"] for c in candidates], dtype=float)
+    dropoffs = np.array([c["destino_geo"]["coordinates"] for c in candidates], dtype=float)
+    # numpy releases the GIL for the heavy parts; keep them off the event loop
+    scores = await loop.run_in_executor(None, score_candidates, route, pickups, dropoffs, query.desvio_km)
+    
+    top = scores["index"][:query.limit]
+    ids = [candidates[i]["id"] for i in top]
+    docs = {
+        doc["id"]: doc
+        for doc in await db.transport_requests.find({"id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))
+    }
+    matches = []
+    for rank, request_id in enumerate(ids):
+        if request_id in docs:
+            matches.append({
+                **docs[request_id],
+                "desvio_km": round(float(scores["detour_km"][rank]), 2),
+                "recogida_km": round(float(scores["pickup_km"][rank]), 2),
+                "entrega_km": round(float(scores["dropoff_km"][rank]), 2),
+            })
+    record_latency("route_matches", time.perf_counter() - started)
+    return matches
 
 @api_router.get("/requests/{request_id}", response_model=TransportRequest)
 async def get_request(request_id: str, current_user: User = Depends(get_current_user)):
@@ -451,6 +1101,7 @@ async def update_request_status(request_id: str, estado: str, current_user: User
         {"id": request_id},
         {"$set": {"estado": estado}}
     )
+    invalidate_stats_cache(request["cliente_id"])
     
     return {"message": "Estado actualizado", "estado": estado}
 
@@ -467,13 +1118,17 @@ async def delete_request(request_id: str, current_user: User = Depends(get_curre
         {"id": request_id},
         {"$set": {"estado": "cancelado"}}
     )
+    invalidate_stats_cache(current_user.id)
     
     return {"message": "Solicitud cancelada"}
 
 # ============ OFFER ROUTES ============
 
+# Request states that still take offers
+OPEN_REQUEST_STATES = ["abierto", "en_negociacion"]
+
 @api_router.post("/offers", response_model=Offer)
-async def create_offer(offer_data: OfferCreate, current_user: User = Depends(get_current_user)):
+async def create_offer(offer_data: OfferCreate, current_user: User = Depends(get_entitled_user)):
     if "transportista" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Solo los transportistas pueden hacer ofertas")
     
@@ -501,11 +1156,12 @@ async def create_offer(offer_data: OfferCreate, current_user: User = Depends(get
     
     await db.offers.insert_one(offer_doc)
     
-    # Update request status to en_negociacion
+    # Update request status to en_negociacion, unless it was accepted meanwhile
     await db.transport_requests.update_one(
-        {"id": offer_data.solicitud_id},
+        {"id": offer_data.solicitud_id, "estado": {"$in": OPEN_REQUEST_STATES}},
         {"$set": {"estado": "en_negociacion"}}
     )
+    invalidate_stats_cache(current_user.id)
     
     return Offer(**{k: v for k, v in offer_doc.items() if k != "_id"})
 
@@ -513,48 +1169,55 @@ async def create_offer(offer_data: OfferCreate, current_user: User = Depends(get
 async def get_offers_for_request(request_id: str, current_user: User = Depends(get_current_user)):
     offers = await db.offers.find(
         {"solicitud_id": request_id},
-        {"_id": 0}
+        OFFER_PROJECTION
     ).sort("created_at", -1).to_list(1000)
-    return offers
+    return json_rows(offers, Offer)
 
 @api_router.get("/offers/my-offers", response_model=List[Offer])
 async def get_my_offers(current_user: User = Depends(get_current_user)):
     offers = await db.offers.find(
         {"transportista_id": current_user.id},
-        {"_id": 0}
+        OFFER_PROJECTION
     ).sort("created_at", -1).to_list(1000)
-    return offers
+    return json_rows(offers, Offer)
+
+# Outcomes of accept_offer, served by /admin/metrics
+accept_offer_stats = {"accepted": 0, "conflicts": 0}
 
 @api_router.patch("/offers/{offer_id}/accept")
 async def accept_offer(offer_id: str, current_user: User = Depends(get_current_user)):
-    offer = await db.offers.find_one({"id": offer_id})
+    """
+    Accept an offer. The request is claimed with a single conditional update
+    (still open and owned by the caller), so of two concurrent accepts only
+    one succeeds and the other gets 409. The offers are then settled in one
+    bulk_write.
+    """
+    started = time.perf_counter()
+    offer = await db.offers.find_one({"id": offer_id}, {"_id": 0, "solicitud_id": 1, "transportista_id": 1, "precio_oferta": 1})
     if not offer:
         raise HTTPException(status_code=404, detail="Oferta no encontrada")
     
-    # Check if user is the client
-    request = await db.transport_requests.find_one({"id": offer["solicitud_id"]})
-    if request["cliente_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Solo el cliente puede aceptar ofertas")
-    
-    # Reject all other offers
-    await db.offers.update_many(
-        {"solicitud_id": offer["solicitud_id"], "id": {"$ne": offer_id}},
-        {"$set": {"estado": "rechazada"}}
+    claimed = await db.transport_requests.find_one_and_update(
+        {"id": offer["solicitud_id"], "cliente_id": current_user.id, "estado": {"$in": OPEN_REQUEST_STATES}},
+        {"$set": {"estado": "aceptado", "oferta_aceptada_id": offer_id}},
+        projection={"_id": 0, "id": 1}
     )
+    if not claimed:
+        # Failure path only: find out why the guard did not match
+        request = await db.transport_requests.find_one({"id": offer["solicitud_id"]}, {"_id": 0, "cliente_id": 1, "estado": 1})
+        if not request:
+            raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+        if request["cliente_id"] != current_user.id:
+            raise HTTPException(status_code=403, detail="Solo el cliente puede aceptar ofertas")
+        accept_offer_stats["conflicts"] += 1
+        raise HTTPException(status_code=409, detail="La solicitud ya no admite aceptar ofertas")
+    
+    # Accept this offer and reject all others
+    await db.offers.bulk_write([
+        UpdateOne({"id": offer_id}, {"$set": {"estado": "aceptada"}}),
+        UpdateMany({"solicitud_id": offer["solicitud_id"], "id": {"$ne": offer_id}}, {"$set": {"estado": "rechazada"}}),
+    ], ordered=False)
     
-    # Accept this offer
-    await db.offers.update_one(
-        {"id": offer_id},
-        {"$set": {"estado": "aceptada"}}
-    )
-    
-    # Update request status
-    await db.transport_requests.update_one(
-        {"id": offer["solicitud_id"]},
-        {"$set": {"estado": "aceptado"}}
-    )
-    
-    # Create transaction record (simulated)
     # Record transaction (without commission - direct payment between parties)
     transaction_doc = {
         "id": str(uuid.uuid4()),
@@ -565,7 +1228,10 @@ async def accept_offer(offer_id: str, current_user: User = Depends(get_current_u
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.transactions.insert_one(transaction_doc)
+    invalidate_stats_cache(current_user.id, offer["transportista_id"])
     
+    accept_offer_stats["accepted"] += 1
+    record_latency("accept_offer", time.perf_counter() - started)
     return {"message": "Oferta aceptada"}
 
 @api_router.patch("/offers/{offer_id}/reject")
@@ -583,6 +1249,7 @@ async def reject_offer(offer_id: str, current_user: User = Depends(get_current_u
         {"id": offer_id},
         {"$set": {"estado": "rechazada"}}
     )
+    invalidate_stats_cache(offer["transportista_id"])
     
     return {"message": "Oferta rechazada"}
 
@@ -590,14 +1257,6 @@ async def reject_offer(offer_id: str, current_user: User = Depends(get_current_u
 
 @api_router.post("/ratings", response_model=Rating)
 async def create_rating(rating_data: RatingCreate, current_user: User = Depends(get_current_user)):
-    # Check if rating already exists
-    existing = await db.ratings.find_one({
-        "from_user_id": current_user.id,
-        "solicitud_id": rating_data.solicitud_id
-    })
-    if existing:
-        raise HTTPException(status_code=400, detail="Ya has calificado esta transacción")
-    
     # Validate rating
     if rating_data.rating < 1 or rating_data.rating > 5:
         raise HTTPException(status_code=400, detail="La calificación debe ser entre 1 y 5")
@@ -614,75 +1273,221 @@ async def create_rating(rating_data: RatingCreate, current_user: User = Depends(
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.ratings.insert_one(rating_doc)
+    # The unique (from_user_id, solicitud_id) index rejects a second rating.
+    # Until reconciliation confirms it exists (it cannot be built while old
+    # duplicates remain), check first as well.
+    if not index_present("ratings", "from_user_solicitud_unique"):
+        existing = await db.ratings.find_one(
+            {"from_user_id": current_user.id, "solicitud_id": rating_data.solicitud_id},
+            {"_id": 0, "id": 1}
+        )
+        if existing:
+            raise HTTPException(status_code=400, detail="Ya has calificado esta transacción")
+    try:
+        await db.ratings.insert_one(rating_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Ya has calificado esta transacción")
     
-    # Update user's average rating using aggregation
-    pipeline = [
-        {"$match": {"to_user_id": rating_data.to_user_id}},
-        {"$group": {"_id": None, "avg_rating": {"$avg": "$rating"}, "count": {"$sum": 1}}}
-    ]
-    result = await db.ratings.aggregate(pipeline).to_list(1)
+    # Running average: one atomic pipeline update adds to the sum and count
+    # and recomputes the average, so concurrent ratings cannot overwrite
+    # each other. Users rated before rating_sum existed start from
+    # rating * num_ratings.
+    await db.users.update_one(
+        {"id": rating_data.to_user_id},
+        [
+            {"$set": {
+                "rating_sum": {"$add": [
+                    {"$ifNull": ["$rating_sum", {"$multiply": [{"$ifNull": ["$rating", 0]}, {"$ifNull": ["$num_ratings", 0]}]}]},
+                    rating_data.rating
+                ]},
+                "num_ratings": {"$add": [{"$ifNull": ["$num_ratings", 0]}, 1]},
+            }},
+            {"$set": {"rating": {"$round": [{"$divide": ["$rating_sum", "$num_ratings"]}, 2]}}},
+        ]
+    )
+    invalidate_user_cache(rating_data.to_user_id)
     
-    if result:
-        avg_rating = result[0]["avg_rating"]
-        count = result[0]["count"]
-        await db.users.update_one(
-            {"id": rating_data.to_user_id},
-            {"$set": {"rating": round(avg_rating, 2), "num_ratings": count}}
+    return Rating(**{k: v for k, v in rating_doc.items() if k != "_id"})
+
+async def rebuild_user_ratings() -> dict:
+    """Recompute every user's rating_sum, num_ratings and rating from db.ratings"""
+    started = time.perf_counter()
+    stamp = datetime.now(timezone.utc).isoformat()
+    
+    operations = [
+        UpdateOne(
+            {"id": row["_id"]},
+            {"$set": {
+                "rating_sum": row["sum"],
+                "num_ratings": row["count"],
+                "rating": round(row["sum"] / row["count"], 2),
+                "ratings_rebuilt_at": stamp,
+            }}
         )
+        async for row in db.ratings.aggregate([
+            {"$group": {"_id": "$to_user_id", "sum": {"$sum": "$rating"}, "count": {"$sum": 1}}},
+        ])
+    ]
+    for i in range(0, len(operations), 1000):
+        await db.users.bulk_write(operations[i:i + 1000], ordered=False)
+    # Users whose ratings were all removed
+    reset = await db.users.update_many(
+        {"ratings_rebuilt_at": {"$ne": stamp}, "$or": [{"num_ratings": {"$gt": 0}}, {"rating_sum": {"$exists": False}}]},
+        {"$set": {"rating_sum": 0.0, "num_ratings": 0, "rating": 0.0, "ratings_rebuilt_at": stamp}}
+    )
+    user_cache.clear()
     
-    return Rating(**{k: v for k, v in rating_doc.items() if k != "_id"})
+    return {
+        "rated_users": len(operations),
+        "reset_to_zero": reset.modified_count,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
 
 @api_router.get("/ratings/user/{user_id}", response_model=List[Rating])
 async def get_user_ratings(user_id: str):
     ratings = await db.ratings.find(
         {"to_user_id": user_id},
-        {"_id": 0}
+        RATING_PROJECTION
     ).sort("created_at", -1).limit(50).to_list(50)
-    return ratings
+    return json_rows(ratings, Rating)
 
 # ============ DASHBOARD ROUTES ============
 
+# Per-user dashboard stats, keyed by user id. Invalidated by this process's
+# writes that change a user's counts; otherwise stale for at most
+# STATS_CACHE_TTL_SECONDS.
+stats_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=STATS_CACHE_TTL_SECONDS)
+
+ACTIVE_REQUEST_STATES = ["abierto", "en_negociacion", "aceptado", "en_transito"]
+
+def invalidate_stats_cache(*user_ids: str):
+    for user_id in user_ids:
+        stats_cache.pop(user_id, None)
+
+async def count_facets(collection, match: dict, facets: Dict[str, dict]) -> Dict[str, int]:
+    """Count several sub-filters of `match` in one $facet aggregation"""
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            name: ([{"$match": facet}] if facet else []) + [{"$count": "n"}]
+            for name, facet in facets.items()
+        }},
+    ]
+    row = (await collection.aggregate(pipeline).to_list(1))[0]
+    return {name: row[name][0]["n"] if row[name] else 0 for name in facets}
+
+async def client_stats(user_id: str) -> dict:
+    return await count_facets(db.transport_requests, {"cliente_id": user_id}, {
+        "total_solicitudes": {},
+        "solicitudes_activas": {"estado": {"$in": ACTIVE_REQUEST_STATES}},
+        "solicitudes_completadas": {"estado": "completado"},
+    })
+
+async def transporter_stats(user_id: str) -> dict:
+    return await count_facets(db.offers, {"transportista_id": user_id}, {
+        "total_ofertas": {},
+        "ofertas_aceptadas": {"estado": "aceptada"},
+        "ofertas_pendientes": {"estado": "pendiente"},
+    })
+
 @api_router.get("/dashboard/stats")
 async def get_stats(current_user: User = Depends(get_current_user)):
-    stats = {}
-    
-    if "cliente" in current_user.roles:
-        total_requests = await db.transport_requests.count_documents({"cliente_id": current_user.id})
-        active_requests = await db.transport_requests.count_documents({
-            "cliente_id": current_user.id,
-            "estado": {"$in": ["abierto", "en_negociacion", "aceptado", "en_transito"]}
-        })
-        completed_requests = await db.transport_requests.count_documents({
-            "cliente_id": current_user.id,
-            "estado": "completado"
-        })
-        stats["cliente"] = {
-            "total_solicitudes": total_requests,
-            "solicitudes_activas": active_requests,
-            "solicitudes_completadas": completed_requests
-        }
+    stats = stats_cache.get(current_user.id)
+    if stats is not None:
+        return stats
     
-    if "transportista" in current_user.roles:
-        total_offers = await db.offers.count_documents({"transportista_id": current_user.id})
-        accepted_offers = await db.offers.count_documents({
-            "transportista_id": current_user.id,
-            "estado": "aceptada"
-        })
-        pending_offers = await db.offers.count_documents({
-            "transportista_id": current_user.id,
-            "estado": "pendiente"
-        })
-        stats["transportista"] = {
-            "total_ofertas": total_offers,
-            "ofertas_aceptadas": accepted_offers,
-            "ofertas_pendientes": pending_offers
-        }
+    roles = [role for role in ("cliente", "transportista") if role in current_user.roles]
+    loaders = {"cliente": client_stats, "transportista": transporter_stats}
+    results = await asyncio.gather(*(loaders[role](current_user.id) for role in roles))
+    stats = dict(zip(roles, results))
     
+    stats_cache[current_user.id] = stats
     return stats
 
 # ============ STRIPE PAYMENT ROUTES ============
 
+# Transactions in these states never change again; their status is served
+# from the local record instead of asking Stripe
+FINAL_PAYMENT_STATES = ("paid", "expired")
+
+# One client per webhook URL (in practice one per deployment), so the
+# underlying HTTP connections are reused across requests
+stripe_clients = LRUCache(maxsize=8)
+checkout_status_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=CHECKOUT_STATUS_CACHE_TTL_SECONDS)
+checkout_status_stats = {"local": 0, "cached": 0, "stripe": 0}
+
+def get_stripe_checkout(http_request: Request) -> StripeCheckout:
+    webhook_url = f"{str(http_request.base_url).rstrip('/')}/api/webhook/stripe"
+    stripe_checkout = stripe_clients.get(webhook_url)
+    if stripe_checkout is None:
+        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        stripe_clients[webhook_url] = stripe_checkout
+    return stripe_checkout
+
+async def activate_payment(session_id: str, checkout_status: str = "complete") -> Optional[dict]:
+    """
+    Mark a checkout session paid and grant what it bought. Idempotent: the
+    status poll and the webhook worker both call it, possibly more than once
+    for the same session, and every step only takes effect the first time.
+    Returns the transaction, or None if the session is unknown.
+    """
+    checkout_status_cache.pop(session_id, None)
+    transaction = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "status": {"$ne": "paid"}},
+        {"$set": {
+            "status": "paid",
+            "checkout_status": checkout_status,
+            "payment_status": "paid",
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if transaction:
+        await bump_platform_stats(total_paid_transactions=1)
+    else:
+        transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+        if not transaction:
+            return None
+    
+    if transaction["payment_type"] == "subscription":
+        # Keyed by transaction so a retry after a partial failure still
+        # creates the subscription, and never creates it twice
+        now = datetime.now(timezone.utc)
+        result = await db.subscriptions.update_one(
+            {"transaction_id": transaction["id"]},
+            {"$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "user_id": transaction["user_id"],
+                "status": "active",
+                "start_date": now.isoformat(),
+                "end_date": (now + timedelta(days=30)).isoformat(),
+                "amount": SUBSCRIPTION_PRICE,
+                "payment_method": "stripe"
+            }},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            entitlement_cache.pop(transaction["user_id"], None)
+            notification_outbox.add(
+                transaction["user_id"],
+                "payment",
+                "Suscripción activada ✓",
+                f"Tu suscripción de {SUBSCRIPTION_PRICE}€ está activa durante 30 días.",
+                "/transportista"
+            )
+    return transaction
+
+def local_checkout_status(transaction: dict) -> dict:
+    """Status response for a transaction already in a final state"""
+    paid = transaction["status"] == "paid"
+    return {
+        "status": transaction.get("checkout_status", "complete" if paid else "expired"),
+        "payment_status": transaction.get("payment_status", "paid" if paid else "unpaid"),
+        "amount": transaction["amount"],
+        "currency": transaction["currency"]
+    }
+
 @api_router.post("/payments/stripe/subscription")
 async def create_stripe_subscription(request_data: SubscriptionRequest, http_request: Request, current_user: User = Depends(get_current_user)):
     """Create Stripe checkout session for transporter subscription"""
@@ -690,16 +1495,11 @@ async def create_stripe_subscription(request_data: SubscriptionRequest, http_req
         raise HTTPException(status_code=403, detail="Solo los transportistas pueden suscribirse")
     
     # Check if already subscribed
-    existing_sub = await db.subscriptions.find_one({
-        "user_id": current_user.id,
-        "status": "active"
-    })
-    if existing_sub:
+    if await is_entitled(current_user.id):
         raise HTTPException(status_code=400, detail="Ya tienes una suscripción activa")
     
     try:
-        webhook_url = f"{str(http_request.base_url).rstrip('/')}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
+        stripe_checkout = get_stripe_checkout(http_request)
         
         success_url = f"{request_data.origin_url}/payments/success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{request_data.origin_url}/payments/cancel"
@@ -749,46 +1549,46 @@ async def create_stripe_subscription(request_data: SubscriptionRequest, http_req
 @api_router.get("/payments/stripe/status/{session_id}")
 async def get_stripe_payment_status(session_id: str, http_request: Request, current_user: User = Depends(get_current_user)):
     """Get Stripe payment status and update transaction"""
+    transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+    if transaction and transaction["status"] in FINAL_PAYMENT_STATES:
+        checkout_status_stats["local"] += 1
+        return local_checkout_status(transaction)
+    
+    cached = checkout_status_cache.get(session_id)
+    if cached is not None:
+        checkout_status_stats["cached"] += 1
+        return cached
+    
     try:
-        webhook_url = f"{str(http_request.base_url).rstrip('/')}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+        checkout_status_stats["stripe"] += 1
+        checkout_status: CheckoutStatusResponse = await get_stripe_checkout(http_request).get_checkout_status(session_id)
         
         # Update transaction in database
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
         if transaction:
             new_status = "paid" if checkout_status.payment_status == "paid" else checkout_status.status
             
-            # Only update if not already processed
-            if transaction["status"] != "paid":
+            if new_status == "paid":
+                await activate_payment(session_id, checkout_status.status)
+            else:
                 await db.payment_transactions.update_one(
-                    {"session_id": session_id},
+                    {"session_id": session_id, "status": {"$ne": "paid"}},
                     {"$set": {
                         "status": new_status,
+                        "checkout_status": checkout_status.status,
+                        "payment_status": checkout_status.payment_status,
                         "updated_at": datetime.now(timezone.utc).isoformat()
                     }}
                 )
-                
-                # If subscription paid, create subscription record
-                if new_status == "paid" and transaction["payment_type"] == "subscription":
-                    sub_doc = {
-                        "id": str(uuid.uuid4()),
-                        "user_id": transaction["user_id"],
-                        "status": "active",
-                        "start_date": datetime.now(timezone.utc).isoformat(),
-                        "end_date": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
-                        "amount": SUBSCRIPTION_PRICE,
-                        "payment_method": "stripe"
-                    }
-                    await db.subscriptions.insert_one(sub_doc)
         
-        return {
+        response = {
             "status": checkout_status.status,
             "payment_status": checkout_status.payment_status,
             "amount": checkout_status.amount_total / 100,  # Convert from cents
             "currency": checkout_status.currency
         }
+        if checkout_status.payment_status != "paid" and checkout_status.status != "expired":
+            checkout_status_cache[session_id] = response
+        return response
     
     except Exception as e:
         logger.error(f"Error getting Stripe payment status: {str(e)}")
@@ -796,31 +1596,112 @@ async def get_stripe_payment_status(session_id: str, http_request: Request, curr
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
+    """Verify and enqueue a Stripe webhook; processing happens in run_stripe_event_worker"""
+    body = await request.body()
+    signature = request.headers.get("Stripe-Signature")
     try:
-        body = await request.body()
-        signature = request.headers.get("Stripe-Signature")
-        
-        webhook_url = f"{str(request.base_url).rstrip('/')}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-        
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "status": "paid",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-        
-        return {"status": "processed"}
-    
+        webhook_response = await get_stripe_checkout(request).handle_webhook(body, signature)
     except Exception as e:
-        logger.error(f"Stripe webhook error: {str(e)}")
-        return {"status": "error", "message": str(e)}
+        logger.warning(f"Rejected Stripe webhook: {str(e)}")
+        raise HTTPException(status_code=400, detail="Webhook no válido")
+    
+    # Stripe redelivers until it gets a 2xx; the event id makes every
+    # redelivery a no-op
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.stripe_events.update_one(
+        {"id": webhook_response.event_id or f"session:{webhook_response.session_id}"},
+        {"$setOnInsert": {
+            "event_type": webhook_response.event_type,
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        }},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        stripe_event_stats["duplicates"] += 1
+        return {"status": "duplicate"}
+    stripe_event_stats["received"] += 1
+    stripe_event_wakeup.set()
+    return {"status": "received"}
+
+# ============ STRIPE WEBHOOK QUEUE ============
+
+# Verified webhook events wait in stripe_events until a worker claims one by
+# setting a lease; a worker that dies mid-event leaves the lease to expire and
+# another picks the event up. Failures are retried with exponential backoff.
+
+stripe_event_wakeup = asyncio.Event()
+stripe_event_stats = {"received": 0, "duplicates": 0, "processed": 0, "retried": 0, "failed": 0}
+
+async def process_stripe_event(event: dict):
+    if event["payment_status"] == "paid" and event.get("session_id"):
+        # The transaction is inserted right after the session is created, so
+        # a fast webhook can get here first; retrying covers that gap
+        if await activate_payment(event["session_id"]) is None:
+            raise LookupError(f"No transaction for session {event['session_id']}")
+
+async def claim_stripe_event() -> Optional[dict]:
+    now = datetime.now(timezone.utc)
+    return await db.stripe_events.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+            {"status": "processing", "lease_until": {"$lt": now.isoformat()}},
+        ]},
+        {
+            "$set": {"status": "processing", "lease_until": (now + timedelta(seconds=STRIPE_EVENT_LEASE_SECONDS)).isoformat()},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("next_attempt_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def settle_stripe_event(event: dict, error: Optional[Exception] = None):
+    now = datetime.now(timezone.utc)
+    if error is None:
+        update = {"$set": {"status": "done", "processed_at": now.isoformat()}, "$unset": {"lease_until": ""}}
+        stripe_event_stats["processed"] += 1
+    elif event["attempts"] >= STRIPE_EVENT_MAX_ATTEMPTS:
+        update = {"$set": {"status": "failed", "last_error": str(error)}, "$unset": {"lease_until": ""}}
+        stripe_event_stats["failed"] += 1
+        logger.error(f"Stripe event {event['id']} failed after {event['attempts']} attempts: {str(error)}")
+    else:
+        retry_at = now + timedelta(seconds=min(3600, 5 * 2 ** event["attempts"]))
+        update = {
+            "$set": {"status": "pending", "next_attempt_at": retry_at.isoformat(), "last_error": str(error)},
+            "$unset": {"lease_until": ""}
+        }
+        stripe_event_stats["retried"] += 1
+    await db.stripe_events.update_one({"id": event["id"], "status": "processing"}, update)
+
+async def run_stripe_event_worker():
+    """Drain stripe_events; woken by the webhook, polling as a fallback for retries and other workers' events"""
+    while True:
+        try:
+            event = await claim_stripe_event()
+            if event is None:
+                try:
+                    await asyncio.wait_for(stripe_event_wakeup.wait(), timeout=STRIPE_EVENT_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                stripe_event_wakeup.clear()
+                continue
+            try:
+                await process_stripe_event(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await settle_stripe_event(event, e)
+            else:
+                await settle_stripe_event(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Stripe event worker error: {str(e)}")
+            await asyncio.sleep(STRIPE_EVENT_POLL_SECONDS)
 
 # ============ SUBSCRIPTION STATUS ============
 
@@ -830,28 +1711,34 @@ async def get_subscription_status(current_user: User = Depends(get_current_user)
     if "transportista" not in current_user.roles:
         return {"has_subscription": False, "message": "Solo transportistas necesitan suscripción"}
     
-    subscription = await db.subscriptions.find_one({
-        "user_id": current_user.id,
-        "status": "active"
-    }, {"_id": 0})
-    
+    # Lapsed subscriptions are moved to expired by expire_subscriptions
+    now = datetime.now(timezone.utc)
+    subscription = await db.subscriptions.find_one(
+        {"user_id": current_user.id, "status": "active", "end_date": {"$gt": now.isoformat()}},
+        {"_id": 0},
+        sort=[("end_date", DESCENDING)]
+    )
     if subscription:
         end_date = datetime.fromisoformat(subscription["end_date"].replace('Z', '+00:00'))
-        if end_date > datetime.now(timezone.utc):
-            return {
-                "has_subscription": True,
-                "subscription": subscription,
-                "days_remaining": (end_date - datetime.now(timezone.utc)).days
-            }
-        else:
-            # Subscription expired
-            await db.subscriptions.update_one(
-                {"id": subscription["id"]},
-                {"$set": {"status": "expired"}}
-            )
+        return {
+            "has_subscription": True,
+            "subscription": subscription,
+            "days_remaining": (end_date - now).days
+        }
     
     return {"has_subscription": False, "message": "No tienes suscripción activa"}
 
+async def expire_subscriptions() -> dict:
+    """Move every active subscription past its end_date to expired"""
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.subscriptions.update_many(
+        {"status": "active", "end_date": {"$lte": now}},
+        {"$set": {"status": "expired", "expired_at": now}}
+    )
+    if result.modified_count:
+        logger.info(f"Expired {result.modified_count} subscriptions")
+    return {"expired": result.modified_count}
+
 @api_router.get("/payments/history")
 async def get_payment_history(current_user: User = Depends(get_current_user)):
     """Get user's payment history"""
@@ -862,6 +1749,431 @@ async def get_payment_history(current_user: User = Depends(get_current_user)):
     
     return payments
 
+# ============ REALTIME FEEDS ============
+
+class ChangeFeed:
+    """
+    Fan out new documents of one collection to in-process subscribers keyed
+    by one field (e.g. messages by solicitud_id).
+
+    Each worker process runs a single MongoDB change stream, so a document
+    inserted by any uvicorn worker reaches the subscribers of every worker.
+    Without a replica set change streams are unavailable; the feed then falls
+    back to one indexed poll per interval for all keys that have subscribers
+    in this process, on timestamp_field: created_at for insert-only feeds,
+    and a field set on every write (updated_at) for feeds that carry updates.
+    """
+
+    def __init__(self, collection_name: str, key_field: str, operation_types=("insert",), timestamp_field: str = "created_at", poll_interval: float = 1.0):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.timestamp_field = timestamp_field
+        self.operation_types = list(operation_types)
+        self.poll_interval = poll_interval
+        self.subscribers: Dict[str, set] = {}
+        self.mode = "stopped"
+        self.dropped = 0
+
+    def subscribe(self, key: str, maxsize: int = 100) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=maxsize)
+        self.subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[key]
+
+    def publish(self, doc: dict):
+        for queue in list(self.subscribers.get(doc.get(self.key_field), ())):
+            try:
+                queue.put_nowait(dict(doc))
+            except asyncio.QueueFull:
+                # A stalled client must not hold up everyone else; it can
+                # catch up with the regular REST endpoint
+                self.dropped += 1
+
+    async def run(self):
+        resume_token = None
+        while True:
+            try:
+                self.mode = "change_stream"
+                pipeline = [{"$match": {"operationType": {"$in": self.operation_types}}}]
+                async with db[self.collection_name].watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get("fullDocument")
+                        if doc:
+                            doc.pop("_id", None)
+                            self.publish(doc)
+            except OperationFailure as e:
+                if e.code in (40573, 40324) or "replica set" in str(e):
+                    logger.info(f"Change streams unavailable for {self.collection_name}, polling instead")
+                    await self.poll()
+                    return
+                logger.error(f"Change stream on {self.collection_name} failed: {str(e)}")
+                resume_token = None
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Change stream on {self.collection_name} failed: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def poll(self):
+        self.mode = "poll"
+        # Documents can become visible slightly after their timestamp (clock
+        # skew between workers, insert latency), so each poll re-reads a short
+        # window and skips (id, timestamp) pairs it has already published
+        lag = timedelta(seconds=5)
+        watermark = datetime.now(timezone.utc)
+        seen: Dict[tuple, str] = {}
+        ts = self.timestamp_field
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self.subscribers:
+                watermark = datetime.now(timezone.utc)
+                seen.clear()
+                continue
+            try:
+                since = (watermark - lag).isoformat()
+                docs = await db[self.collection_name].find(
+                    {self.key_field: {"$in": list(self.subscribers)}, ts: {"$gt": since}},
+                    {"_id": 0}
+                ).sort(ts, 1).to_list(1000)
+            except Exception as e:
+                logger.error(f"Polling {self.collection_name} failed: {str(e)}")
+                continue
+            for doc in docs:
+                key = (doc["id"], doc[ts])
+                if key not in seen:
+                    seen[key] = doc[ts]
+                    self.publish(doc)
+            watermark = datetime.now(timezone.utc)
+            cutoff = (watermark - lag - lag).isoformat()
+            seen = {key: value for key, value in seen.items() if value > cutoff}
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "keys": len(self.subscribers),
+            "subscribers": sum(len(queues) for queues in self.subscribers.values()),
+            "dropped": self.dropped,
+        }
+
+chat_feed = ChangeFeed("messages", "solicitud_id")
+# Read watermarks, pushed to the chat socket as read receipts
+chat_read_feed = ChangeFeed("chat_reads", "solicitud_id", operation_types=("insert", "update", "replace"), timestamp_field="updated_at")
+# Updates are included so read state reaches the other tabs of the user;
+# every notification write sets updated_at, so the poll fallback sees them too
+notification_feed = ChangeFeed("notifications", "user_id", operation_types=("insert", "update", "replace"), timestamp_field="updated_at")
+
+# Long-running tasks started on startup and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+# ============ UNREAD COUNTERS ============
+
+# One document per user in unread_counters holding {messages, notifications},
+# kept in step with every write that changes read state, so the unread-count
+# endpoints are a single indexed read. Counters can drift when a write fails
+# between the source change and the $inc; rebuild_unread_counters recomputes
+# them from messages, chat_reads and notifications, and runs on startup when
+# the counters have never been built.
+
+async def bump_unread_counters(user_id: str, messages: int = 0, notifications: int = 0):
+    if not messages and not notifications:
+        return
+    # Floored at zero: a decrement for something counted before the
+    # counters existed (or twice by racing readers) must not leave a negative
+    # that would hide the next unread items
+    await db.unread_counters.update_one(
+        {"user_id": user_id},
+        [{"$set": {
+            "messages": {"$max": [0, {"$add": [{"$ifNull": ["$messages", 0]}, messages]}]},
+            "notifications": {"$max": [0, {"$add": [{"$ifNull": ["$notifications", 0]}, notifications]}]},
+        }}],
+        upsert=True
+    )
+
+async def get_unread_counts(user_id: str) -> dict:
+    counters = await db.unread_counters.find_one({"user_id": user_id}, {"_id": 0}) or {}
+    # Clamp transient negatives caused by racing decrements
+    return {
+        "notifications": max(0, counters.get("notifications", 0)),
+        "messages": max(0, counters.get("messages", 0)),
+    }
+
+class NotificationOutbox:
+    """
+    In-process buffer for notification writes. Handlers call add() and
+    return without a database round trip; run() writes the buffer every
+    NOTIFICATION_FLUSH_SECONDS, or as soon as NOTIFICATION_BATCH_SIZE entries
+    are waiting, with one insert_many for plain notifications and one
+    bulk_write for coalesced ones.
+
+    Notifications with a coalesce_key fold into the user's unread
+    notification with the same key: the latest text wins, `count` adds up
+    and created_at moves to the newest event so the feeds push it again.
+    Unread counters only grow for notification documents actually created.
+
+    Entries whose write fails go back to the front of the buffer and are
+    retried with backoff, up to max_attempts. A flush in progress is not
+    cancelled with run(); drain() waits for it and writes what is left.
+    """
+    def __init__(self, batch_size: int, flush_seconds: float, max_attempts: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_attempts = max_attempts
+        self.pending: List[dict] = []
+        self.attempts: Dict[str, int] = {}
+        self.flushing: Optional[asyncio.Future] = None
+        self.wakeup = asyncio.Event()
+        self.counters = {"queued": 0, "written": 0, "coalesced": 0, "batches": 0, "retried": 0, "dropped": 0, "errors": 0}
+
+    def add(self, user_id: str, tipo: str, titulo: str, mensaje: str, link: Optional[str] = None, coalesce_key: Optional[str] = None):
+        now = datetime.now(timezone.utc).isoformat()
+        notification = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "tipo": tipo,
+            "titulo": titulo,
+            "mensaje": mensaje,
+            "link": link,
+            "leida": False,
+            "count": 1,
+            "created_at": now,
+            "updated_at": now
+        }
+        if coalesce_key:
+            notification["coalesce_key"] = coalesce_key
+        self.pending.append(notification)
+        self.counters["queued"] += 1
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def run(self):
+        delay = self.flush_seconds
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            # Shielded so cancelling run() on shutdown never abandons a
+            # batch halfway through its writes
+            self.flushing = asyncio.ensure_future(self.flush())
+            failed = await asyncio.shield(self.flushing)
+            delay = min(30.0, delay * 2) if failed else self.flush_seconds
+
+    async def drain(self):
+        """Finish any flush in progress and write what is left; for shutdown"""
+        if self.flushing is not None:
+            await asyncio.gather(self.flushing, return_exceptions=True)
+        await self.flush()
+        if self.pending:
+            logger.error(f"Notification outbox: {len(self.pending)} notifications could not be written before shutdown")
+
+    async def flush(self) -> int:
+        """Write the buffer; returns how many entries were put back for a retry"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        
+        plain = [n for n in batch if "coalesce_key" not in n]
+        folded: Dict[Tuple[str, str], dict] = {}
+        for notification in batch:
+            if "coalesce_key" in notification:
+                key = (notification["user_id"], notification["coalesce_key"])
+                if key in folded:
+                    notification["count"] += folded[key]["count"]
+                    self.attempts.pop(folded[key]["id"], None)
+                folded[key] = notification
+        
+        created: List[dict] = []
+        failed: List[dict] = []
+        if plain:
+            written, not_written = await self.write_plain(plain)
+            created += written
+            failed += not_written
+        if folded:
+            written, not_written = await self.write_coalesced(list(folded.values()))
+            created += written
+            failed += not_written
+        
+        new_per_user: Dict[str, int] = {}
+        for notification in created:
+            new_per_user[notification["user_id"]] = new_per_user.get(notification["user_id"], 0) + 1
+            self.attempts.pop(notification["id"], None)
+        if new_per_user:
+            try:
+                await db.unread_counters.bulk_write([
+                    UpdateOne({"user_id": user_id}, {"$inc": {"notifications": count}}, upsert=True)
+                    for user_id, count in new_per_user.items()
+                ], ordered=False)
+            except Exception as e:
+                # The notifications exist, so they are not retried; the
+                # counters are off until rebuild_unread_counters runs
+                self.counters["errors"] += 1
+                logger.error(f"Notification outbox could not bump unread counters: {str(e)}")
+        
+        retry = []
+        for notification in failed:
+            attempts = self.attempts.get(notification["id"], 0) + 1
+            if attempts >= self.max_attempts:
+                self.attempts.pop(notification["id"], None)
+                self.counters["dropped"] += 1
+                logger.error(f"Dropped notification {notification['id']} for {notification['user_id']} after {attempts} attempts")
+            else:
+                self.attempts[notification["id"]] = attempts
+                retry.append(notification)
+        self.pending[:0] = retry
+        
+        self.counters["written"] += len(created)
+        self.counters["coalesced"] += len(batch) - len(created) - len(failed)
+        self.counters["retried"] += len(retry)
+        self.counters["batches"] += 1
+        return len(retry)
+
+    async def write_plain(self, notifications: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """Insert plain notifications; returns (created, to retry)"""
+        try:
+            await db.notifications.insert_many(notifications, ordered=False)
+            return notifications, []
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            # A duplicate id means an earlier attempt did insert the document
+            created = [n for i, n in enumerate(notifications) if i not in errors]
+            failed = [notifications[i] for i, error in errors.items() if error.get("code") != 11000]
+            reason = "write errors"
+        except Exception as e:
+            created, failed = [], notifications
+            reason = str(e)
+        if failed:
+            self.counters["errors"] += 1
+            logger.error(f"Notification outbox: {len(failed)} of {len(notifications)} inserts failed: {reason}")
+        return created, failed
+
+    async def write_coalesced(self, notifications: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """Upsert coalesced notifications; returns (newly created, to retry)"""
+        updates = [
+            (
+                {"user_id": n["user_id"], "coalesce_key": n["coalesce_key"], "leida": False},
+                {
+                    "$set": {"titulo": n["titulo"], "mensaje": n["mensaje"], "created_at": n["created_at"], "updated_at": n["updated_at"]},
+                    "$inc": {"count": n["count"]},
+                    "$setOnInsert": {"id": n["id"], "tipo": n["tipo"], "link": n["link"]}
+                }
+            )
+            for n in notifications
+        ]
+        try:
+            result = await db.notifications.bulk_write(
+                [UpdateOne(query, update, upsert=True) for query, update in updates],
+                ordered=False
+            )
+            return [notifications[i] for i in result.upserted_ids], []
+        except BulkWriteError as e:
+            created = [notifications[u["index"]] for u in e.details.get("upserted", [])]
+            failed = []
+            reason = "write errors"
+            for error in e.details.get("writeErrors", []):
+                notification = notifications[error["index"]]
+                if error.get("code") != 11000:
+                    failed.append(notification)
+                    continue
+                # Another worker created the same notification between our
+                # match and insert (unique partial index); fold into it
+                query, update = updates[error["index"]]
+                try:
+                    await db.notifications.update_one(query, update)
+                except Exception:
+                    failed.append(notification)
+        except Exception as e:
+            # Unknown outcome: retrying may count these events twice, which
+            # beats losing them
+            created, failed = [], notifications
+            reason = str(e)
+        if failed:
+            self.counters["errors"] += 1
+            logger.error(f"Notification outbox: {len(failed)} of {len(notifications)} coalesced writes failed: {reason}")
+        return created, failed
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": len(self.pending)}
+
+notification_outbox = NotificationOutbox(NOTIFICATION_BATCH_SIZE, NOTIFICATION_FLUSH_SECONDS, NOTIFICATION_MAX_ATTEMPTS)
+
+async def rebuild_unread_counters() -> dict:
+    """Recompute every user's unread counters from the source collections"""
+    started = time.perf_counter()
+    stamp = datetime.now(timezone.utc).isoformat()
+    
+    notification_counts = {
+        row["_id"]: row["count"]
+        async for row in db.notifications.aggregate([
+            {"$match": {"leida": False}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+        ])
+    }
+    message_counts = {
+        row["_id"]: row["count"]
+        async for row in db.messages.aggregate([
+            {"$match": {"leido": False}},
+            {"$lookup": {
+                "from": "chat_reads",
+                "let": {"solicitud_id": "$solicitud_id", "receiver_id": "$receiver_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$solicitud_id", "$$solicitud_id"]},
+                        {"$eq": ["$user_id", "$$receiver_id"]},
+                    ]}}},
+                    {"$project": {"_id": 0, "last_read_at": 1}},
+                ],
+                "as": "read",
+            }},
+            {"$match": {"$expr": {"$gt": ["$created_at", {"$ifNull": [{"$arrayElemAt": ["$read.last_read_at", 0]}, ""]}]}}},
+            {"$group": {"_id": "$receiver_id", "count": {"$sum": 1}}},
+        ])
+    }
+    
+    user_ids = set(notification_counts) | set(message_counts)
+    operations = [
+        UpdateOne(
+            {"user_id": user_id},
+            {"$set": {
+                "messages": message_counts.get(user_id, 0),
+                "notifications": notification_counts.get(user_id, 0),
+                "rebuilt_at": stamp,
+            }},
+            upsert=True
+        )
+        for user_id in user_ids
+    ]
+    for i in range(0, len(operations), 1000):
+        await db.unread_counters.bulk_write(operations[i:i + 1000], ordered=False)
+    # Users with nothing unread any more
+    reset = await db.unread_counters.update_many(
+        {"rebuilt_at": {"$ne": stamp}},
+        {"$set": {"messages": 0, "notifications": 0, "rebuilt_at": stamp}}
+    )
+    
+    return {
+        "users_with_unread": len(user_ids),
+        "reset_to_zero": reset.modified_count,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+async def backfill_unread_counters():
+    """Build the counters from source on a database where they were never rebuilt"""
+    try:
+        if await db.unread_counters.find_one({"rebuilt_at": {"$exists": True}}, {"_id": 1}):
+            return
+        logger.info(f"Backfilled unread counters: {await rebuild_unread_counters()}")
+    except Exception as e:
+        logger.error(f"Unread counter backfill failed: {str(e)}")
+
 # ============ CHAT ROUTES ============
 
 @api_router.post("/chat/messages")
@@ -905,19 +2217,17 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
     }
     
     await db.messages.insert_one(message_doc)
-    
-    # Create notification for receiver
-    notification_doc = {
-        "id": str(uuid.uuid4()),
-        "user_id": receiver_id,
-        "tipo": "message",
-        "titulo": f"Nuevo mensaje de {current_user.nombre}",
-        "mensaje": filtered_content[:100] + "..." if len(filtered_content) > 100 else filtered_content,
-        "link": f"/request/{message_data.solicitud_id}",
-        "leida": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification_doc)
+    await bump_unread_counters(receiver_id, messages=1)
+    
+    # Notify the receiver; unread message notifications of one chat fold into one
+    notification_outbox.add(
+        receiver_id,
+        "message",
+        f"Nuevo mensaje de {current_user.nombre}",
+        filtered_content[:100] + "..." if len(filtered_content) > 100 else filtered_content,
+        f"/request/{message_data.solicitud_id}",
+        coalesce_key=f"chat:{message_data.solicitud_id}"
+    )
     
     response = {k: v for k, v in message_doc.items() if k != "_id"}
     
@@ -926,45 +2236,182 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
     
     return response
 
-@api_router.get("/chat/messages/{solicitud_id}")
-async def get_messages(solicitud_id: str, current_user: User = Depends(get_current_user)):
-    """Get all messages for a request"""
-    # Verify user has access to this chat
+async def check_chat_access(solicitud_id: str, user: User) -> dict:
+    """Only the client and the accepted transporter can read a request chat"""
     transport_request = await db.transport_requests.find_one({"id": solicitud_id})
     if not transport_request:
         raise HTTPException(status_code=404, detail="Solicitud no encontrada")
     
-    # Check if user is involved
-    accepted_offer = await db.offers.find_one({
-        "solicitud_id": solicitud_id,
-        "estado": "aceptada"
-    })
-    
-    if current_user.id != transport_request["cliente_id"]:
-        if not accepted_offer or current_user.id != accepted_offer["transportista_id"]:
+    if user.id != transport_request["cliente_id"]:
+        accepted_offer = await db.offers.find_one({
+            "solicitud_id": solicitud_id,
+            "estado": "aceptada"
+        })
+        if not accepted_offer or user.id != accepted_offer["transportista_id"]:
             raise HTTPException(status_code=403, detail="No tienes acceso a este chat")
     
-    messages = await db.messages.find(
+    return transport_request
+
+async def mark_chat_read(solicitud_id: str, user_id: str, read_at: str) -> bool:
+    """
+    Move the user's read high-watermark for a conversation forward to read_at.
+    Messages to the user up to the watermark count as read, so reading never
+    rewrites message documents. Returns whether the watermark moved.
+
+    read_at comes from the client, so the watermark is set to the newest
+    message the user actually received at or before it, never past it.
+    """
+    newest = await db.messages.find_one(
+        {"solicitud_id": solicitud_id, "receiver_id": user_id, "created_at": {"$lte": read_at}},
+        {"_id": 0, "created_at": 1},
+        sort=[("created_at", DESCENDING)]
+    )
+    if not newest:
+        return False
+    read_at = newest["created_at"]
+    
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        previous = await db.chat_reads.find_one_and_update(
+            {"solicitud_id": solicitud_id, "user_id": user_id, "last_read_at": {"$lt": read_at}},
+            {
+                "$set": {"last_read_at": read_at, "updated_at": now},
+                "$setOnInsert": {"id": f"{solicitud_id}:{user_id}"}
+            },
+            projection={"_id": 0, "last_read_at": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # The watermark already exists and is at or past read_at
+        return False
+    
+    # Concurrent calls move the watermark over disjoint ranges, so each
+    # newly read message is subtracted exactly once
+    range_query = {"$lte": read_at}
+    if previous:
+        range_query["$gt"] = previous["last_read_at"]
+    newly_read = await db.messages.count_documents({
+        "solicitud_id": solicitud_id,
+        "receiver_id": user_id,
+        "leido": False,
+        "created_at": range_query
+    })
+    await bump_unread_counters(user_id, messages=-newly_read)
+    return True
+
+async def get_read_watermarks(solicitud_id: str) -> Dict[str, str]:
+    reads = await db.chat_reads.find(
         {"solicitud_id": solicitud_id},
-        {"_id": 0, "contenido_original": 0}
-    ).sort("created_at", 1).to_list(500)
+        {"_id": 0, "user_id": 1, "last_read_at": 1}
+    ).to_list(10)
+    return {read["user_id"]: read["last_read_at"] for read in reads}
+
+@api_router.get("/chat/messages/{solicitud_id}")
+async def get_messages(
+    solicitud_id: str,
+    since: Optional[str] = None,
+    after_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get the messages of a request chat. With `since` (created_at of the last
+    message the client has, plus its id as `after_id`) only newer messages are
+    returned, so an idle poll is one small indexed range read and no write.
+    """
+    # Verify user has access to this chat
+    await check_chat_access(solicitud_id, current_user)
+    
+    query = {"solicitud_id": solicitud_id}
+    if since and after_id:
+        query["$or"] = [
+            {"created_at": {"$gt": since}},
+            {"created_at": since, "id": {"$gt": after_id}},
+        ]
+    elif since:
+        query["created_at"] = {"$gt": since}
+    
+    messages, watermarks = await asyncio.gather(
+        db.messages.find(
+            query,
+            {"_id": 0, "contenido_original": 0}
+        ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).to_list(500),
+        get_read_watermarks(solicitud_id)
+    )
+    
+    # Sent messages count as read up to the other participant's watermark;
+    # `leido` is still honoured for messages marked before watermarks existed
+    for message in messages:
+        receiver_read_at = watermarks.get(message["receiver_id"])
+        if receiver_read_at and message["created_at"] <= receiver_read_at:
+            message["leido"] = True
     
     # Mark messages as read
-    await db.messages.update_many(
-        {"solicitud_id": solicitud_id, "receiver_id": current_user.id, "leido": False},
-        {"$set": {"leido": True}}
-    )
+    received = [m["created_at"] for m in messages if m["receiver_id"] == current_user.id]
+    if received and max(received) > watermarks.get(current_user.id, ""):
+        await mark_chat_read(solicitud_id, current_user.id, max(received))
     
     return messages
 
+@api_router.websocket("/chat/ws/{solicitud_id}")
+async def chat_socket(websocket: WebSocket, solicitud_id: str, ticket: Optional[str] = None):
+    """
+    Push new messages of a request chat as they are stored. Browsers cannot
+    set headers on WebSocket requests, so a stream ticket comes as ?ticket=. Access
+    rules are the same as get_messages; failures close with 4000 + HTTP code.
+    Pushes {"type": "message"} and {"type": "read"} (read receipts) frames.
+    Messages are still sent with POST /chat/messages.
+    """
+    await websocket.accept()
+    try:
+        user = await get_user_from_stream_ticket(ticket)
+        await check_chat_access(solicitud_id, user)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code)
+        return
+    
+    queue = chat_feed.subscribe(solicitud_id)
+    read_queue = chat_read_feed.subscribe(solicitud_id)
+    
+    async def push():
+        while True:
+            message = await queue.get()
+            message.pop("contenido_original", None)
+            await websocket.send_json({"type": "message", "message": message})
+    
+    async def push_reads():
+        while True:
+            read = await read_queue.get()
+            await websocket.send_json({"type": "read", "user_id": read["user_id"], "last_read_at": read["last_read_at"]})
+    
+    async def receive():
+        # The only frame clients send is {"type": "read", "last_read_at": ...};
+        # receiving is also how a disconnect is noticed
+        try:
+            while True:
+                frame = await websocket.receive_json()
+                if isinstance(frame, dict) and frame.get("type") == "read" and isinstance(frame.get("last_read_at"), str):
+                    await mark_chat_read(solicitud_id, user.id, frame["last_read_at"])
+        except (WebSocketDisconnect, ValueError):
+            pass
+    
+    tasks = [asyncio.create_task(push()), asyncio.create_task(push_reads()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        chat_feed.unsubscribe(solicitud_id, queue)
+        chat_read_feed.unsubscribe(solicitud_id, read_queue)
+        for task in tasks:
+            task.cancel()
+        # Collect results so a send on a closed socket is not reported as an
+        # unretrieved task exception
+        await asyncio.gather(*tasks, return_exceptions=True)
+
 @api_router.get("/chat/unread-count")
 async def get_unread_count(current_user: User = Depends(get_current_user)):
     """Get count of unread messages"""
-    count = await db.messages.count_documents({
-        "receiver_id": current_user.id,
-        "leido": False
-    })
-    return {"unread_count": count}
+    counts = await get_unread_counts(current_user.id)
+    return {"unread_count": counts["messages"]}
 
 # ============ NOTIFICATION ROUTES ============
 
@@ -981,43 +2428,532 @@ async def get_notifications(current_user: User = Depends(get_current_user)):
 @api_router.get("/notifications/unread-count")
 async def get_unread_notification_count(current_user: User = Depends(get_current_user)):
     """Get count of unread notifications"""
-    count = await db.notifications.count_documents({
-        "user_id": current_user.id,
-        "leida": False
-    })
-    return {"unread_count": count}
+    counts = await get_unread_counts(current_user.id)
+    return {"unread_count": counts["notifications"]}
+
+def format_sse(event: str, data: dict, event_id: Optional[str] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+@api_router.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    ticket: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Server-Sent Events stream of the user's notifications.
+    Emits `notification` events (new or updated documents) followed by an
+    `unread` event with the current counters, plus a comment heartbeat every
+    SSE_HEARTBEAT_SECONDS. EventSource cannot send headers, so a stream
+    ticket may come as ?ticket=. On reconnect the browser sends Last-Event-ID
+    (or the client passes ?last_event_id=) and the notifications created
+    after it are replayed first.
+    """
+    if credentials:
+        current_user = await get_user_from_token(credentials.credentials)
+    else:
+        current_user = await get_user_from_stream_ticket(ticket)
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    resume_query = None
+    if resume_from:
+        created_at, doc_id = decode_cursor(resume_from, 2)
+        resume_query = {
+            "user_id": current_user.id,
+            "$or": [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "id": {"$gt": doc_id}},
+            ]
+        }
+    
+    async def event_stream():
+        # Subscribe before replaying so nothing created in between is lost
+        queue = notification_feed.subscribe(current_user.id)
+        try:
+            yield "retry: 5000\n\n"
+            if resume_query:
+                missed = await db.notifications.find(
+                    resume_query, {"_id": 0}
+                ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).to_list(SSE_REPLAY_LIMIT)
+                for doc in missed:
+                    yield format_sse("notification", doc, encode_cursor(doc["created_at"], doc["id"]))
+            yield format_sse("unread", await get_unread_counts(current_user.id))
+            
+            while True:
+                try:
+                    doc = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                
+                # Coalesce bursts: send every queued document, then one counter update
+                docs = [doc]
+                while not queue.empty():
+                    docs.append(queue.get_nowait())
+                for doc in docs:
+                    yield format_sse("notification", doc, encode_cursor(doc["created_at"], doc["id"]))
+                yield format_sse("unread", await get_unread_counts(current_user.id))
+        finally:
+            notification_feed.unsubscribe(current_user.id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.patch("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: User = Depends(get_current_user)):
     """Mark notification as read"""
+    # Only unread ones match, so updated_at (and the unread counter) only
+    # change when the read state does
     result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"leida": True}}
+        {"id": notification_id, "user_id": current_user.id, "leida": False},
+        {"$set": {"leida": True, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    if result.matched_count == 0:
+        exists = await db.notifications.find_one({"id": notification_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
+        if not exists:
+            raise HTTPException(status_code=404, detail="Notificación no encontrada")
+    await bump_unread_counters(current_user.id, notifications=-result.modified_count)
     return {"message": "Notificación marcada como leída"}
 
 @api_router.patch("/notifications/read-all")
 async def mark_all_notifications_read(current_user: User = Depends(get_current_user)):
     """Mark all notifications as read"""
-    await db.notifications.update_many(
+    result = await db.notifications.update_many(
         {"user_id": current_user.id, "leida": False},
-        {"$set": {"leida": True}}
+        {"$set": {"leida": True, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    await bump_unread_counters(current_user.id, notifications=-result.modified_count)
     return {"message": "Todas las notificaciones marcadas como leídas"}
 
+# ============ BLOB STORAGE ============
+
+# Uploaded images live in the "blobs" GridFS bucket instead of inside the
+# documents that reference them. Blobs are content-addressed: the public blob
+# id is the SHA-256 of the bytes (metadata.sha256, unique), so identical
+# uploads are stored once and documents only keep the id, e.g.
+# verification["blobs"]["foto_vehiculo"]. metadata.owners lists the users
+# allowed to read a blob; admins can read any blob and public blobs (profile
+# photos) can be read by anyone.
+blob_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="blobs")
+
+def blob_url(blob_id: str, variant: Optional[str] = None) -> str:
+    return f"/api/blobs/{blob_id}" + (f"?variant={variant}" if variant else "")
+
+def blob_signature(blob_id: str, expires: int) -> str:
+    digest = hmac.new(JWT_SECRET.encode('utf-8'), f"blob:{blob_id}:{expires}".encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode('ascii')
+
+def signed_blob_url(blob_id: str, variant: Optional[str] = None) -> str:
+    """
+    URL of a private blob that works without headers (for <img>) for
+    SIGNED_BLOB_URL_SECONDS to twice that. Expiry is rounded to the window,
+    so the URL stays the same, and cacheable, within it.
+    """
+    expires = (int(time.time()) // SIGNED_BLOB_URL_SECONDS + 2) * SIGNED_BLOB_URL_SECONDS
+    query = f"expires={expires}&sig={blob_signature(blob_id, expires)}"
+    return f"/api/blobs/{blob_id}?{query}" + (f"&variant={variant}" if variant else "")
+
+def valid_blob_signature(blob_id: str, expires: Optional[int], sig: Optional[str]) -> bool:
+    if expires is None or not sig or expires < time.time():
+        return False
+    return hmac.compare_digest(sig, blob_signature(blob_id, expires))
+
+def decode_data_url(value: str) -> Tuple[str, bytes]:
+    """
+    Decode a base64 data URL (or bare base64) image into its content type and
+    bytes. The type declared in the data URL header is ignored; the one
+    stored is sniffed from the bytes, and anything but JPEG, PNG or WebP is
+    refused, the same as for multipart uploads, as is anything over
+    UPLOAD_MAX_BYTES (checked on the encoded length, before decoding).
+    """
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    if len(value) // 4 * 3 > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="El archivo es demasiado grande")
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Imagen no válida")
+    content_type = sniff_image_type(data[:16])
+    if not content_type:
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado (JPEG, PNG o WebP)")
+    return content_type, data
+
+async def find_blob(blob_id: str) -> Optional[dict]:
+    return await db["blobs.files"].find_one({"metadata.sha256": blob_id})
+
+async def add_blob_owner(blob_id: str, owner_id: str, public: bool = False):
+    update = {"$addToSet": {"metadata.owners": owner_id}}
+    if public:
+        update["$set"] = {"metadata.public": True}
+    await db["blobs.files"].update_one({"metadata.sha256": blob_id}, update)
+
+# The only types download_blob serves inline
+SAFE_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Content type from the file's magic bytes; None if not an accepted image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+async def write_blob(
+    chunks,
+    content_type: str,
+    owner_id: str,
+    public: bool = False,
+    max_bytes: Optional[int] = None,
+    variant_of: Optional[str] = None
+) -> str:
+    """
+    Write an async iterable of byte chunks to the blob bucket, hashing as the
+    chunks arrive. The content hash is only known at the end, so the GridFS
+    file is finalized under it then, or dropped if the content already exists.
+    New images are queued for the variant pipeline unless they are variants.
+    """
+    grid_in = blob_bucket.open_upload_stream(
+        "upload",
+        chunk_size_bytes=BLOB_CHUNK_BYTES,
+        metadata={"content_type": content_type, "owners": [owner_id], "public": public}
+    )
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise HTTPException(status_code=413, detail="El archivo es demasiado grande")
+            digest.update(chunk)
+            await grid_in.write(chunk)
+        
+        blob_id = digest.hexdigest()
+        if await find_blob(blob_id):
+            await grid_in.abort()
+            await add_blob_owner(blob_id, owner_id, public)
+            return blob_id
+        metadata = {"sha256": blob_id, "content_type": content_type, "owners": [owner_id], "public": public}
+        needs_variants = variant_of is None and content_type.startswith("image/")
+        if variant_of:
+            metadata["variant_of"] = variant_of
+        elif needs_variants:
+            metadata["pending_variants"] = True
+        await grid_in.set("filename", blob_id)
+        await grid_in.set("metadata", metadata)
+        await grid_in.close()
+        if needs_variants:
+            image_queue.put_nowait(blob_id)
+    except DuplicateKeyError:
+        # The same content was stored concurrently; drop our chunks
+        await grid_in.abort()
+        await add_blob_owner(blob_id, owner_id, public)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    return blob_id
+
+async def store_blob(data: bytes, content_type: str, owner_id: str, public: bool = False, variant_of: Optional[str] = None) -> str:
+    """Store bytes in the blob bucket unless already present; returns the blob id"""
+    blob_id = hashlib.sha256(data).hexdigest()
+    if await find_blob(blob_id):
+        await add_blob_owner(blob_id, owner_id, public)
+        return blob_id
+    
+    async def single_chunk():
+        yield data
+    return await write_blob(single_chunk(), content_type, owner_id, public, variant_of=variant_of)
+
+async def store_upload(upload: UploadFile, owner_id: str, public: bool = False) -> str:
+    """
+    Stream an uploaded image to the blob bucket one chunk at a time, checking
+    its type from the first chunk and its size as it goes.
+    """
+    head = await upload.read(BLOB_CHUNK_BYTES)
+    content_type = sniff_image_type(head)
+    if not content_type:
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado (JPEG, PNG o WebP)")
+    
+    async def chunks():
+        chunk = head
+        while chunk:
+            yield chunk
+            chunk = await upload.read(BLOB_CHUNK_BYTES)
+    try:
+        return await write_blob(chunks(), content_type, owner_id, public, max_bytes=UPLOAD_MAX_BYTES)
+    finally:
+        await upload.close()
+
+async def store_images(images: Dict[str, Union[str, UploadFile, None]], owner_id: str) -> Dict[str, str]:
+    """Store base64 strings or uploaded files as blobs, returning {field: blob id}"""
+    blobs = {}
+    for field, value in images.items():
+        if isinstance(value, str):
+            if value:
+                content_type, data = decode_data_url(value)
+                blobs[field] = await store_blob(data, content_type, owner_id)
+        elif value is not None and value.filename:
+            blobs[field] = await store_upload(value, owner_id)
+    return blobs
+
+class UploadSizeLimitMiddleware:
+    """
+    Answer 413 to multipart and JSON requests whose Content-Length is over
+    the limit for their type before any of the body is read; route
+    dependencies would only run after FastAPI has parsed the whole body.
+    """
+    def __init__(self, app, max_bytes: int, max_json_bytes: int):
+        self.app = app
+        self.limits = {b"multipart/form-data": max_bytes, b"application/json": max_json_bytes}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            length = headers.get(b"content-length", b"")
+            limit = self.limits.get(headers.get(b"content-type", b"").split(b";")[0].strip())
+            if limit is not None and length.isdigit() and int(length) > limit:
+                response = JSONResponse({"detail": "El archivo es demasiado grande"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+def can_read_blob(blob: dict, user: User) -> bool:
+    metadata = blob.get("metadata") or {}
+    return metadata.get("public", False) or user.id in metadata.get("owners", []) or "admin" in user.roles
+
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single `bytes=start-end` Range header into inclusive offsets.
+    Returns None for headers we do not understand (multiple ranges, other
+    units), in which case the whole blob is served as allowed by RFC 9110.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        start, end = (max(0, size - suffix), size - 1) if suffix else (size, size - 1)
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Rango no válido",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+async def migrate_verification_images() -> dict:
+    """Move base64 images embedded in verification documents to the blob bucket"""
+    started = time.perf_counter()
+    migrated, failed = 0, 0
+    for kind, (collection_name, image_fields) in VERIFICATION_QUEUES.items():
+        collection = db[collection_name]
+        projection = {"_id": 0, "id": 1, "user_id": 1}
+        projection.update({field: 1 for field in image_fields})
+        cursor = collection.find(
+            {"$or": [{field: {"$type": "string"}} for field in image_fields]},
+            projection
+        )
+        async for doc in cursor:
+            images = {field: doc.get(field) for field in image_fields}
+            try:
+                blobs = await store_images(images, doc["user_id"])
+            except HTTPException as e:
+                # Undecodable, or not a JPEG/PNG/WebP image
+                logger.error(f"Rejected image in {collection_name} {doc['id']} ({e.status_code}), left in place")
+                failed += 1
+                continue
+            await collection.update_one(
+                {"id": doc["id"]},
+                {
+                    "$set": {f"blobs.{field}": blob_id for field, blob_id in blobs.items()},
+                    "$unset": {field: "" for field in image_fields}
+                }
+            )
+            migrated += 1
+    return {
+        "migrated": migrated,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+@api_router.get("/blobs/{blob_id}")
+async def download_blob(
+    blob_id: str,
+    request: Request,
+    variant: Optional[str] = None,
+    expires: Optional[int] = None,
+    sig: Optional[str] = None,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Stream a stored blob chunk by chunk. Honours single byte-range requests
+    (206) and If-None-Match; blob ids are content hashes, so responses are
+    cacheable forever. Public blobs (profile photos) need no credentials;
+    for the rest <img> tags cannot send headers, so they use the
+    signed_blob_url handed out by the endpoints that return them.
+    ?variant=display|thumb serves the re-encoded copy when it is ready and
+    the original until then. Blobs are served with nosniff and a sandbox
+    CSP, and anything that is not an accepted image type (blobs stored
+    before types were sniffed) as an attachment, so stored content can
+    never run as a page on the API origin.
+    """
+    if variant is not None and variant not in IMAGE_VARIANT_SIZES:
+        raise HTTPException(status_code=400, detail="Variante no válida")
+    blob = await find_blob(blob_id)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    if not blob["metadata"].get("public", False) and not valid_blob_signature(blob_id, expires, sig):
+        if credentials is None:
+            raise HTTPException(status_code=401, detail="Enlace caducado o no válido")
+        current_user = await get_user_from_token(credentials.credentials)
+        if not can_read_blob(blob, current_user):
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    # Access is decided on the original; variants inherit it
+    cache_control = "private, max-age=31536000, immutable"
+    if variant:
+        variant_blob = None
+        variant_id = blob["metadata"].get("variants", {}).get(variant)
+        if variant_id:
+            variant_blob = await find_blob(variant_id)
+        if variant_blob:
+            blob = variant_blob
+        else:
+            # Still processing: the same URL will change content later
+            cache_control = "private, no-cache"
+    
+    etag = f'"{blob["metadata"]["sha256"]}"'
+    content_type = blob["metadata"].get("content_type", "application/octet-stream")
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "sandbox",
+    }
+    if content_type not in SAFE_IMAGE_TYPES:
+        headers["Content-Disposition"] = "attachment"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    size = blob["length"]
+    byte_range = parse_byte_range(request.headers["range"], size) if "range" in request.headers else None
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    grid_out = await blob_bucket.open_download_stream(blob["_id"])
+    if start:
+        grid_out.seek(start)
+    
+    async def body():
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+    
+    return StreamingResponse(
+        body(),
+        status_code=206 if byte_range else 200,
+        media_type=content_type,
+        headers=headers
+    )
+
+# ============ IMAGE PIPELINE ============
+
+# New image blobs are flagged metadata.pending_variants and queued here.
+# Workers download the original, render IMAGE_VARIANT_SIZES on a process
+# pool (Pillow decoding and resampling would otherwise block the event loop)
+# and store each variant as its own blob, recorded in metadata.variants.
+# Blobs still flagged at startup are queued again.
+image_executor = ProcessPoolExecutor(
+    max_workers=IMAGE_WORKERS,
+    mp_context=multiprocessing.get_context("spawn")
+)
+image_queue: asyncio.Queue = asyncio.Queue()
+
+async def render_blob_variants(blob_id: str):
+    blob = await find_blob(blob_id)
+    if not blob or not blob["metadata"].get("pending_variants"):
+        return
+    metadata = blob["metadata"]
+    
+    grid_out = await blob_bucket.open_download_stream(blob["_id"])
+    data = await grid_out.read()
+    
+    started = time.perf_counter()
+    try:
+        rendered = await asyncio.get_running_loop().run_in_executor(
+            image_executor, render_variants, data, IMAGE_VARIANT_SIZES, IMAGE_QUALITY
+        )
+    except Exception as e:
+        # Not decodable: keep serving the original for every variant
+        logger.warning(f"Image variants failed for blob {blob_id}: {str(e)}")
+        await db["blobs.files"].update_one(
+            {"_id": blob["_id"]},
+            {"$set": {"metadata.variants_error": str(e)}, "$unset": {"metadata.pending_variants": ""}}
+        )
+        return
+    record_latency("image_variants", time.perf_counter() - started)
+    
+    variants = {}
+    for name, (content, content_type) in rendered.items():
+        variants[name] = await store_blob(
+            content, content_type, metadata["owners"][0], metadata.get("public", False), variant_of=blob_id
+        )
+    await db["blobs.files"].update_one(
+        {"_id": blob["_id"]},
+        {"$set": {"metadata.variants": variants}, "$unset": {"metadata.pending_variants": ""}}
+    )
+
+async def run_image_pipeline():
+    while True:
+        blob_id = await image_queue.get()
+        try:
+            await render_blob_variants(blob_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Image pipeline error for blob {blob_id}: {str(e)}")
+        finally:
+            image_queue.task_done()
+
+async def requeue_pending_images() -> int:
+    queued = 0
+    async for blob in db["blobs.files"].find({"metadata.pending_variants": True}, {"metadata.sha256": 1}):
+        image_queue.put_nowait(blob["metadata"]["sha256"])
+        queued += 1
+    return queued
+
 # ============ VERIFICATION ROUTES ============
 
-@api_router.post("/verification/identity")
-async def submit_identity_verification(
+async def create_identity_verification(
+    current_user: User,
     tipo_documento: str,
     numero_documento: str,
-    documento_imagen: str,
-    selfie_imagen: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Submit identity verification documents"""
+    images: Dict[str, Union[str, UploadFile, None]]
+) -> dict:
     # Check if already has pending or approved verification
     existing = await db.identity_verifications.find_one({
         "user_id": current_user.id,
@@ -1034,8 +2970,7 @@ async def submit_identity_verification(
         "user_id": current_user.id,
         "tipo_documento": tipo_documento,
         "numero_documento": numero_documento,
-        "documento_imagen": documento_imagen,
-        "selfie_imagen": selfie_imagen,
+        "blobs": await store_images(images, current_user.id),
         "status": "pending",
         "admin_notes": None,
         "created_at": datetime.now(timezone.utc).isoformat(),
@@ -1043,15 +2978,45 @@ async def submit_identity_verification(
     }
     
     await db.identity_verifications.insert_one(verification_doc)
+    await bump_platform_stats(pending_identity_verifications=1)
     
     # Update user verification status
     await db.users.update_one(
         {"id": current_user.id},
         {"$set": {"identity_verification_status": "pending"}}
     )
+    invalidate_user_cache(current_user.id)
     
     return {"id": verification_id, "status": "pending", "message": "Verificación enviada correctamente"}
 
+@api_router.post("/verification/identity")
+async def submit_identity_verification(
+    tipo_documento: str,
+    numero_documento: str,
+    documento_imagen: str,
+    selfie_imagen: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Submit identity verification documents as base64 (prefer /verification/identity/upload)"""
+    return await create_identity_verification(
+        current_user, tipo_documento, numero_documento,
+        {"documento_imagen": documento_imagen, "selfie_imagen": selfie_imagen}
+    )
+
+@api_router.post("/verification/identity/upload")
+async def upload_identity_verification(
+    tipo_documento: str = Form(...),
+    numero_documento: str = Form(...),
+    documento_imagen: UploadFile = File(...),
+    selfie_imagen: Optional[UploadFile] = File(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Submit identity verification documents as multipart files"""
+    return await create_identity_verification(
+        current_user, tipo_documento, numero_documento,
+        {"documento_imagen": documento_imagen, "selfie_imagen": selfie_imagen}
+    )
+
 @api_router.get("/verification/identity/status")
 async def get_identity_verification_status(current_user: User = Depends(get_current_user)):
     """Get identity verification status"""
@@ -1065,20 +3030,15 @@ async def get_identity_verification_status(current_user: User = Depends(get_curr
     
     return verification
 
-@api_router.post("/verification/vehicle")
-async def submit_vehicle_verification(
+async def create_vehicle_verification(
+    current_user: User,
     tipo_vehiculo: str,
     marca: str,
     modelo: str,
     ano: int,
     matricula: str,
-    foto_vehiculo: str,
-    foto_matricula: str,
-    permiso_circulacion: Optional[str] = None,
-    seguro_imagen: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Submit vehicle verification documents (transporters only)"""
+    images: Dict[str, Union[str, UploadFile, None]]
+) -> dict:
     if "transportista" not in current_user.roles:
         raise HTTPException(status_code=403, detail="Solo transportistas pueden verificar vehículos")
     
@@ -1102,10 +3062,7 @@ async def submit_vehicle_verification(
         "modelo": modelo,
         "ano": ano,
         "matricula": matricula,
-        "foto_vehiculo": foto_vehiculo,
-        "foto_matricula": foto_matricula,
-        "permiso_circulacion": permiso_circulacion,
-        "seguro_imagen": seguro_imagen,
+        "blobs": await store_images(images, current_user.id),
         "status": "pending",
         "admin_notes": None,
         "created_at": datetime.now(timezone.utc).isoformat(),
@@ -1113,15 +3070,65 @@ async def submit_vehicle_verification(
     }
     
     await db.vehicle_verifications.insert_one(verification_doc)
+    await bump_platform_stats(pending_vehicle_verifications=1)
     
     # Update user vehicle verification status
     await db.users.update_one(
         {"id": current_user.id},
         {"$set": {"vehicle_verification_status": "pending"}}
     )
+    invalidate_user_cache(current_user.id)
     
     return {"id": verification_id, "status": "pending", "message": "Verificación de vehículo enviada correctamente"}
 
+@api_router.post("/verification/vehicle")
+async def submit_vehicle_verification(
+    tipo_vehiculo: str,
+    marca: str,
+    modelo: str,
+    ano: int,
+    matricula: str,
+    foto_vehiculo: str,
+    foto_matricula: str,
+    permiso_circulacion: Optional[str] = None,
+    seguro_imagen: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Submit vehicle verification documents as base64 (prefer /verification/vehicle/upload)"""
+    return await create_vehicle_verification(
+        current_user, tipo_vehiculo, marca, modelo, ano, matricula,
+        {
+            "foto_vehiculo": foto_vehiculo,
+            "foto_matricula": foto_matricula,
+            "permiso_circulacion": permiso_circulacion,
+            "seguro_imagen": seguro_imagen,
+        }
+    )
+
+@api_router.post("/verification/vehicle/upload")
+async def upload_vehicle_verification(
+    tipo_vehiculo: str = Form(...),
+    marca: str = Form(...),
+    modelo: str = Form(...),
+    ano: int = Form(...),
+    matricula: str = Form(...),
+    foto_vehiculo: UploadFile = File(...),
+    foto_matricula: UploadFile = File(...),
+    permiso_circulacion: Optional[UploadFile] = File(None),
+    seguro_imagen: Optional[UploadFile] = File(None),
+    current_user: User = Depends(get_current_user)
+):
+    """Submit vehicle verification documents as multipart files (transporters only)"""
+    return await create_vehicle_verification(
+        current_user, tipo_vehiculo, marca, modelo, ano, matricula,
+        {
+            "foto_vehiculo": foto_vehiculo,
+            "foto_matricula": foto_matricula,
+            "permiso_circulacion": permiso_circulacion,
+            "seguro_imagen": seguro_imagen,
+        }
+    )
+
 @api_router.get("/verification/vehicle/status")
 async def get_vehicle_verification_status(current_user: User = Depends(get_current_user)):
     """Get vehicle verification status"""
@@ -1164,14 +3171,20 @@ async def update_profile(
     foto_perfil: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Update user profile"""
+    """
+    Update user profile. A base64 foto_perfil goes through the same type and
+    size checks as PUT /users/me/photo, which newer clients use instead.
+    """
     update_data = {}
     if nombre:
         update_data["nombre"] = nombre
     if telefono:
         update_data["telefono"] = telefono
     if foto_perfil:
-        update_data["foto_perfil"] = foto_perfil
+        content_type, data = decode_data_url(foto_perfil)
+        blob_id = await store_blob(data, content_type, current_user.id, public=True)
+        # Avatars are shown small everywhere; serve the thumbnail variant
+        update_data["foto_perfil"] = blob_url(blob_id, "thumb")
     
     if not update_data:
         raise HTTPException(status_code=400, detail="No hay datos para actualizar")
@@ -1182,66 +3195,211 @@ async def update_profile(
         {"id": current_user.id},
         {"$set": update_data}
     )
+    invalidate_user_cache(current_user.id)
     
     updated_user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "hashed_password": 0})
     return updated_user
 
+@api_router.put("/users/me/photo")
+async def upload_profile_photo(foto: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+    """Upload the profile photo as a multipart file"""
+    blob_id = await store_upload(foto, current_user.id, public=True)
+    # Avatars are shown small everywhere; serve the thumbnail variant
+    foto_perfil = blob_url(blob_id, "thumb")
+    await db.users.update_one(
+        {"id": current_user.id},
+        {"$set": {"foto_perfil": foto_perfil, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    invalidate_user_cache(current_user.id)
+    return {"foto_perfil": foto_perfil}
+
+# ============ PLATFORM STATS ============
+
+# Admin statistics live in one platform_stats document that the writes
+# behind each figure keep current with $inc. reconcile_platform_stats
+# recounts everything from source every PLATFORM_STATS_RECONCILE_SECONDS
+# and on demand, correcting any drift.
+PLATFORM_STATS_ID = "global"
+
+PLATFORM_STATS_QUERIES = {
+    "total_users": ("users", {}),
+    "total_requests": ("transport_requests", {}),
+    "pending_identity_verifications": ("identity_verifications", {"status": "pending"}),
+    "pending_vehicle_verifications": ("vehicle_verifications", {"status": "pending"}),
+    "total_paid_transactions": ("payment_transactions", {"status": "paid"}),
+}
+
+async def bump_platform_stats(**deltas: int):
+    # No upsert: the document is only ever created by a full recount, so a
+    # bump before the first reconcile cannot leave partial figures behind
+    await db.platform_stats.update_one(
+        {"id": PLATFORM_STATS_ID, "reconciled_at": {"$exists": True}},
+        {"$inc": deltas}
+    )
+
+async def reconcile_platform_stats() -> dict:
+    """Recount every platform statistic and overwrite the stats document"""
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(
+        db[collection_name].count_documents(query)
+        for collection_name, query in PLATFORM_STATS_QUERIES.values()
+    ))
+    recounted = dict(zip(PLATFORM_STATS_QUERIES, counts))
+    
+    # Increments that land while counting may be overwritten; the next run
+    # picks them up again
+    previous = await db.platform_stats.find_one_and_update(
+        {"id": PLATFORM_STATS_ID},
+        {"$set": {**recounted, "reconciled_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    ) or {}
+    return {
+        "stats": recounted,
+        "drift": {field: count - previous.get(field, 0) for field, count in recounted.items() if count != previous.get(field, 0)},
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+async def run_periodically(name: str, interval_seconds: int, job):
+    """Run `job` every interval_seconds until cancelled, logging failures"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Periodic job {name} failed: {str(e)}")
+
 # ============ ADMIN ROUTES ============
 
 @api_router.get("/admin/stats")
 async def get_admin_stats(admin: User = Depends(get_admin_user)):
     """Get admin dashboard statistics"""
-    total_users = await db.users.count_documents({})
-    total_requests = await db.transport_requests.count_documents({})
-    pending_identity = await db.identity_verifications.count_documents({"status": "pending"})
-    pending_vehicle = await db.vehicle_verifications.count_documents({"status": "pending"})
-    total_transactions = await db.payment_transactions.count_documents({"status": "paid"})
-    
-    return {
-        "total_users": total_users,
-        "total_requests": total_requests,
-        "pending_identity_verifications": pending_identity,
-        "pending_vehicle_verifications": pending_vehicle,
-        "total_paid_transactions": total_transactions
-    }
-
-@api_router.get("/admin/verifications/identity")
-async def get_identity_verifications(status: Optional[str] = "pending", admin: User = Depends(get_admin_user)):
-    """Get all identity verifications (admin only)"""
-    query = {}
+    stats = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0})
+    if not stats or "reconciled_at" not in stats:
+        await reconcile_platform_stats()
+        stats = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0})
+    return {field: max(0, stats.get(field, 0)) for field in PLATFORM_STATS_QUERIES}
+
+@api_router.post("/admin/maintenance/expire-subscriptions")
+async def run_expire_subscriptions(admin: User = Depends(get_admin_user)):
+    """Expire lapsed subscriptions now instead of waiting for the sweeper (admin only)"""
+    return await expire_subscriptions()
+
+@api_router.post("/admin/maintenance/rebuild-ratings")
+async def run_rebuild_user_ratings(admin: User = Depends(get_admin_user)):
+    """Recompute all user ratings from source (admin only)"""
+    return await rebuild_user_ratings()
+
+@api_router.post("/admin/maintenance/reconcile-platform-stats")
+async def run_reconcile_platform_stats(admin: User = Depends(get_admin_user)):
+    """Recount admin statistics from source (admin only)"""
+    return await reconcile_platform_stats()
+
+# Collection and image fields of each verification queue. Images are left out
+# of the queue listings and resolved by /admin/verifications/{kind}/{id}/images:
+# blob URLs for stored images, inline base64 for documents not yet migrated.
+VERIFICATION_QUEUES = {
+    "identity": ("identity_verifications", ("documento_imagen", "selfie_imagen")),
+    "vehicle": ("vehicle_verifications", ("foto_vehiculo", "foto_matricula", "permiso_circulacion", "seguro_imagen")),
+}
+
+# Applicant fields shown next to each verification
+VERIFICATION_USER_FIELDS = {"_id": 0, "id": 1, "nombre": 1, "email": 1, "telefono": 1, "roles": 1, "rating": 1, "num_ratings": 1, "created_at": 1}
+
+async def list_verifications(kind: str, status: Optional[str], cursor: Optional[str], limit: int, response: Response) -> list:
+    """
+    One keyset page of a verification queue with the applicant joined in by
+    $lookup, so the whole page is a single round trip without image payloads.
+    """
+    collection_name, image_fields = VERIFICATION_QUEUES[kind]
+    query = keyset_after(cursor)
     if status:
         query["status"] = status
     
-    verifications = await db.identity_verifications.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    # Add user info to each verification
-    for v in verifications:
-        user = await db.users.find_one({"id": v["user_id"]}, {"_id": 0, "hashed_password": 0})
-        v["user"] = user
-    
+    projection = {"_id": 0}
+    projection.update({field: 0 for field in image_fields})
+    verifications = await db[collection_name].aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$project": projection},
+        # Plain equality join: before MongoDB 5.0 a let/$expr sub-pipeline
+        # cannot use the users id index and scans the collection per row. The
+        # combined localField + pipeline form needs 5.0, so the applicant is
+        # cut down to VERIFICATION_USER_FIELDS in the $set instead
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "id",
+            "as": "user",
+        }},
+        {"$set": {"user": {"$let": {
+            "vars": {"user": {"$arrayElemAt": ["$user", 0]}},
+            "in": {"$cond": [
+                {"$ifNull": ["$$user", False]},
+                {field: f"$$user.{field}" for field, keep in VERIFICATION_USER_FIELDS.items() if keep},
+                "$$REMOVE",
+            ]},
+        }}}},
+    ]).to_list(limit + 1)
+    
+    if len(verifications) > limit:
+        verifications = verifications[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(verifications[-1]["created_at"], verifications[-1]["id"])
+    for verification in verifications:
+        verification["thumbnails"] = {
+            field: signed_blob_url(blob_id, "thumb")
+            for field, blob_id in (verification.get("blobs") or {}).items()
+        }
     return verifications
 
+@api_router.get("/admin/verifications/identity")
+async def get_identity_verifications(
+    response: Response,
+    status: Optional[str] = "pending",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin: User = Depends(get_admin_user)
+):
+    """Get identity verifications without images (admin only)"""
+    return await list_verifications("identity", status, cursor, limit, response)
+
 @api_router.get("/admin/verifications/vehicle")
-async def get_vehicle_verifications(status: Optional[str] = "pending", admin: User = Depends(get_admin_user)):
-    """Get all vehicle verifications (admin only)"""
-    query = {}
-    if status:
-        query["status"] = status
-    
-    verifications = await db.vehicle_verifications.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    # Add user info to each verification
-    for v in verifications:
-        user = await db.users.find_one({"id": v["user_id"]}, {"_id": 0, "hashed_password": 0})
-        v["user"] = user
+async def get_vehicle_verifications(
+    response: Response,
+    status: Optional[str] = "pending",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin: User = Depends(get_admin_user)
+):
+    """Get vehicle verifications without images (admin only)"""
+    return await list_verifications("vehicle", status, cursor, limit, response)
+
+@api_router.get("/admin/verifications/{kind}/{verification_id}/images")
+async def get_verification_images(kind: str, verification_id: str, admin: User = Depends(get_admin_user)):
+    """Get the images of one verification (admin only)"""
+    if kind not in VERIFICATION_QUEUES:
+        raise HTTPException(status_code=404, detail="Tipo de verificación no válido")
+    collection_name, image_fields = VERIFICATION_QUEUES[kind]
+    
+    projection = {"_id": 0, "id": 1, "blobs": 1}
+    projection.update({field: 1 for field in image_fields})
+    verification = await db[collection_name].find_one({"id": verification_id}, projection)
+    if not verification:
+        raise HTTPException(status_code=404, detail="Verificación no encontrada")
     
-    return verifications
+    # Display-sized copies for review, originals kept for audit
+    blobs = verification.pop("blobs", None) or {}
+    verification.update({field: signed_blob_url(blob_id, "display") for field, blob_id in blobs.items()})
+    verification["originals"] = {field: signed_blob_url(blob_id) for field, blob_id in blobs.items()}
+    return verification
+
+@api_router.post("/admin/maintenance/migrate-verification-images")
+async def run_migrate_verification_images(admin: User = Depends(get_admin_user)):
+    """Move embedded verification images to blob storage (admin only)"""
+    return await migrate_verification_images()
 
 @api_router.patch("/admin/verifications/identity/{verification_id}")
 async def update_identity_verification(
@@ -1254,38 +3412,37 @@ async def update_identity_verification(
     if status not in ["approved", "rejected"]:
         raise HTTPException(status_code=400, detail="Status debe ser 'approved' o 'rejected'")
     
-    verification = await db.identity_verifications.find_one({"id": verification_id})
-    if not verification:
-        raise HTTPException(status_code=404, detail="Verificación no encontrada")
-    
-    await db.identity_verifications.update_one(
+    # The previous document tells whether this review takes it off the queue
+    verification = await db.identity_verifications.find_one_and_update(
         {"id": verification_id},
         {"$set": {
             "status": status,
             "admin_notes": admin_notes,
             "updated_at": datetime.now(timezone.utc).isoformat(),
             "reviewed_by": admin.id
-        }}
+        }},
+        return_document=ReturnDocument.BEFORE
     )
+    if not verification:
+        raise HTTPException(status_code=404, detail="Verificación no encontrada")
+    if verification["status"] == "pending":
+        await bump_platform_stats(pending_identity_verifications=-1)
     
     # Update user verification status
     await db.users.update_one(
         {"id": verification["user_id"]},
         {"$set": {"identity_verification_status": status}}
     )
+    invalidate_user_cache(verification["user_id"])
     
     # Create notification for user
-    notification_doc = {
-        "id": str(uuid.uuid4()),
-        "user_id": verification["user_id"],
-        "tipo": "verification",
-        "titulo": "Verificación de Identidad " + ("Aprobada ✓" if status == "approved" else "Rechazada"),
-        "mensaje": admin_notes if admin_notes else ("Tu identidad ha sido verificada correctamente." if status == "approved" else "Tu verificación fue rechazada. Por favor, intenta de nuevo."),
-        "link": "/profile",
-        "leida": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification_doc)
+    notification_outbox.add(
+        verification["user_id"],
+        "verification",
+        "Verificación de Identidad " + ("Aprobada ✓" if status == "approved" else "Rechazada"),
+        admin_notes if admin_notes else ("Tu identidad ha sido verificada correctamente." if status == "approved" else "Tu verificación fue rechazada. Por favor, intenta de nuevo."),
+        "/profile"
+    )
     
     return {"message": f"Verificación {status}", "verification_id": verification_id}
 
@@ -1300,19 +3457,21 @@ async def update_vehicle_verification(
     if status not in ["approved", "rejected"]:
         raise HTTPException(status_code=400, detail="Status debe ser 'approved' o 'rejected'")
     
-    verification = await db.vehicle_verifications.find_one({"id": verification_id})
-    if not verification:
-        raise HTTPException(status_code=404, detail="Verificación no encontrada")
-    
-    await db.vehicle_verifications.update_one(
+    # The previous document tells whether this review takes it off the queue
+    verification = await db.vehicle_verifications.find_one_and_update(
         {"id": verification_id},
         {"$set": {
             "status": status,
             "admin_notes": admin_notes,
             "updated_at": datetime.now(timezone.utc).isoformat(),
             "reviewed_by": admin.id
-        }}
+        }},
+        return_document=ReturnDocument.BEFORE
     )
+    if not verification:
+        raise HTTPException(status_code=404, detail="Verificación no encontrada")
+    if verification["status"] == "pending":
+        await bump_platform_stats(pending_vehicle_verifications=-1)
     
     # Update user vehicle verification status
     if status == "approved":
@@ -1320,19 +3479,16 @@ async def update_vehicle_verification(
             {"id": verification["user_id"]},
             {"$set": {"has_verified_vehicle": True}}
         )
+        invalidate_user_cache(verification["user_id"])
     
     # Create notification for user
-    notification_doc = {
-        "id": str(uuid.uuid4()),
-        "user_id": verification["user_id"],
-        "tipo": "verification",
-        "titulo": f"Verificación de Vehículo ({verification['matricula']}) " + ("Aprobada ✓" if status == "approved" else "Rechazada"),
-        "mensaje": admin_notes if admin_notes else ("Tu vehículo ha sido verificado correctamente." if status == "approved" else "La verificación de tu vehículo fue rechazada. Por favor, intenta de nuevo."),
-        "link": "/profile",
-        "leida": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.notifications.insert_one(notification_doc)
+    notification_outbox.add(
+        verification["user_id"],
+        "verification",
+        f"Verificación de Vehículo ({verification['matricula']}) " + ("Aprobada ✓" if status == "approved" else "Rechazada"),
+        admin_notes if admin_notes else ("Tu vehículo ha sido verificado correctamente." if status == "approved" else "La verificación de tu vehículo fue rechazada. Por favor, intenta de nuevo."),
+        "/profile"
+    )
     
     return {"message": f"Verificación {status}", "verification_id": verification_id}
 
@@ -1345,6 +3501,59 @@ async def get_all_users(admin: User = Depends(get_admin_user)):
     ).sort("created_at", -1).to_list(500)
     return users
 
+@api_router.get("/admin/metrics")
+async def get_metrics(admin: User = Depends(get_admin_user)):
+    """Get in-process cache, pool and latency counters for this worker (admin only)"""
+    lookups = user_cache_stats["hits"] + user_cache_stats["misses"]
+    attempts = accept_offer_stats["accepted"] + accept_offer_stats["conflicts"]
+    return {
+        "user_cache": {
+            **user_cache_stats,
+            "hit_ratio": round(user_cache_stats["hits"] / lookups, 4) if lookups else None,
+            "size": len(user_cache),
+            "maxsize": user_cache.maxsize,
+            "ttl_seconds": user_cache.ttl,
+        },
+        "entitlement_cache": {
+            **entitlement_cache_stats,
+            "size": len(entitlement_cache),
+            "ttl_seconds": entitlement_cache.ttl,
+            "enforced": REQUIRE_SUBSCRIPTION,
+        },
+        "stats_cache": {
+            "size": len(stats_cache),
+            "ttl_seconds": stats_cache.ttl,
+        },
+        "checkout_status": {
+            **checkout_status_stats,
+            "cache_size": len(checkout_status_cache),
+            "ttl_seconds": checkout_status_cache.ttl,
+        },
+        "route_matches": route_match_stats,
+        "stripe_events": stripe_event_stats,
+        "notification_outbox": notification_outbox.stats(),
+        "accept_offer": {
+            **accept_offer_stats,
+            "conflict_rate": round(accept_offer_stats["conflicts"] / attempts, 4) if attempts else None,
+        },
+        "bcrypt": {
+            **bcrypt_stats,
+            "workers": BCRYPT_WORKERS,
+            "max_pending": BCRYPT_MAX_PENDING,
+        },
+        "latency": latency_summary(),
+        "feeds": {
+            "chat": chat_feed.stats(),
+            "chat_reads": chat_read_feed.stats(),
+            "notifications": notification_feed.stats(),
+        },
+    }
+
+@api_router.post("/admin/maintenance/rebuild-unread-counters")
+async def run_rebuild_unread_counters(admin: User = Depends(get_admin_user)):
+    """Recompute all unread counters from source (admin only)"""
+    return await rebuild_unread_counters()
+
 @api_router.patch("/admin/users/{user_id}/role")
 async def update_user_role(user_id: str, roles: List[str], admin: User = Depends(get_admin_user)):
     """Update user roles (admin only)"""
@@ -1356,18 +3565,218 @@ async def update_user_role(user_id: str, roles: List[str], admin: User = Depends
         {"id": user_id},
         {"$set": {"roles": roles}}
     )
+    invalidate_user_cache(user_id)
     
     return {"message": "Roles actualizados", "user_id": user_id, "roles": roles}
 
+# ============ DATABASE INDEXES ============
+
+# Declared index set for every collection queried above. Names are explicit so
+# reconciliation can compare the declared set against what the server reports.
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+    ],
+    "transport_requests": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Keyset pagination indexes: equality filter first, then (created_at, id)
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("estado", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="estado_created_at_id"),
+        IndexModel([("tipo_carga", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="tipo_carga_created_at_id"),
+        IndexModel([("estado", ASCENDING), ("tipo_carga", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="estado_tipo_carga_created_at_id"),
+        IndexModel([("cliente_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="cliente_created_at_id"),
+        IndexModel([("cliente_id", ASCENDING), ("estado", ASCENDING)], name="cliente_estado"),
+        IndexModel([("origen_geo", GEOSPHERE), ("estado", ASCENDING), ("tipo_carga", ASCENDING)], name="origen_geo_estado_tipo_carga"),
+        IndexModel(
+            [("titulo", TEXT), ("descripcion", TEXT), ("origen", TEXT), ("destino", TEXT), ("tipo_carga", TEXT)],
+            name="text_search",
+            default_language="spanish",
+            weights={"titulo": 10, "origen": 5, "destino": 5, "tipo_carga": 3, "descripcion": 1}
+        ),
+        IndexModel([("destino_geo", GEOSPHERE), ("estado", ASCENDING), ("tipo_carga", ASCENDING)], name="destino_geo_estado_tipo_carga"),
+    ],
+    "offers": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("solicitud_id", ASCENDING), ("created_at", DESCENDING)], name="solicitud_created_at"),
+        IndexModel([("solicitud_id", ASCENDING), ("estado", ASCENDING)], name="solicitud_estado"),
+        IndexModel([("transportista_id", ASCENDING), ("created_at", DESCENDING)], name="transportista_created_at"),
+        IndexModel([("transportista_id", ASCENDING), ("estado", ASCENDING)], name="transportista_estado"),
+    ],
+    "ratings": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("to_user_id", ASCENDING), ("created_at", DESCENDING)], name="to_user_created_at"),
+        IndexModel([("from_user_id", ASCENDING), ("solicitud_id", ASCENDING)], name="from_user_solicitud_unique", unique=True),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("solicitud_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="solicitud_created_at_id"),
+        IndexModel([("receiver_id", ASCENDING), ("leido", ASCENDING)], name="receiver_leido"),
+        IndexModel([("solicitud_id", ASCENDING), ("receiver_id", ASCENDING), ("leido", ASCENDING), ("created_at", ASCENDING)], name="solicitud_receiver_leido_created_at"),
+        IndexModel([("solicitud_id", ASCENDING), ("receiver_id", ASCENDING), ("created_at", DESCENDING)], name="solicitud_receiver_created_at"),
+    ],
+    "chat_reads": [
+        IndexModel([("solicitud_id", ASCENDING), ("user_id", ASCENDING)], name="solicitud_user_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "blobs.files": [
+        IndexModel([("metadata.sha256", ASCENDING)], name="sha256_unique", unique=True),
+        IndexModel([("metadata.pending_variants", ASCENDING)], name="pending_variants", sparse=True),
+    ],
+    "platform_stats": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "unread_counters": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("rebuilt_at", ASCENDING)], name="rebuilt_at"),
+    ],
+    "notifications": [
+        IndexModel(
+            [("user_id", ASCENDING), ("coalesce_key", ASCENDING)],
+            name="user_coalesce_key_unread_unique",
+            unique=True,
+            partialFilterExpression={"leida": False, "coalesce_key": {"$exists": True}}
+        ),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("user_id", ASCENDING), ("leida", ASCENDING)], name="user_leida"),
+        # Poll fallback of notification_feed
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING)], name="user_updated_at"),
+    ],
+    "stripe_events": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ],
+    "subscriptions": [
+        IndexModel(
+            [("transaction_id", ASCENDING)],
+            name="transaction_id_unique",
+            unique=True,
+            partialFilterExpression={"transaction_id": {"$exists": True}}
+        ),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        IndexModel([("status", ASCENDING), ("end_date", ASCENDING)], name="status_end_date"),
+    ],
+    "payment_transactions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_at"),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "identity_verifications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "vehicle_verifications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("matricula", ASCENDING), ("status", ASCENDING)], name="user_matricula_status"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+}
+
+# Older indexes on the same keys as a declared one that replaces them, e.g.
+# non-unique -> unique. MongoDB refuses two indexes on one key pattern, so
+# reconciliation drops these before creating the replacement and restores
+# them if the replacement cannot be built (typically existing duplicates).
+SUPERSEDED_INDEXES = {
+    "ratings": {
+        "from_user_solicitud_unique": [
+            IndexModel([("from_user_id", ASCENDING), ("solicitud_id", ASCENDING)], name="from_user_solicitud"),
+        ],
+    },
+}
+
+# Last reconciliation report, served by /admin/indexes
+index_report: Dict[str, dict] = {}
+
+def index_present(collection_name: str, index_name: str) -> bool:
+    """Whether the last reconciliation found or built the index"""
+    return index_name in index_report.get(collection_name, {}).get("present", [])
+
+async def ensure_indexes() -> Dict[str, dict]:
+    """
+    Create any declared index that is missing and report index usage.
+    Returns {collection: {created, missing, failed, present, unused, undeclared}}.
+    Indexes that exist but are not declared are reported, never dropped,
+    except those listed in SUPERSEDED_INDEXES once their replacement exists.
+    """
+    report = {}
+    for collection_name, models in INDEX_SPECS.items():
+        collection = db[collection_name]
+        existing = {index["name"] async for index in collection.list_indexes()}
+        declared = {model.document["name"] for model in models}
+        missing = [model for model in models if model.document["name"] not in existing]
+
+        created, failed = [], []
+        for model in missing:
+            name = model.document["name"]
+            replaced = [old for old in SUPERSEDED_INDEXES.get(collection_name, {}).get(name, []) if old.document["name"] in existing]
+            try:
+                for old in replaced:
+                    await collection.drop_index(old.document["name"])
+                    existing.discard(old.document["name"])
+                await collection.create_indexes([model])
+                created.append(name)
+            except OperationFailure as e:
+                # Usually pre-existing duplicates for a unique index or a
+                # conflicting definition under the same key pattern
+                logger.error(f"Index {collection_name}.{name} could not be created: {str(e)}")
+                failed.append(name)
+                for old in replaced:
+                    if old.document["name"] not in existing:
+                        await collection.create_indexes([old])
+                        existing.add(old.document["name"])
+
+        # $indexStats counters reset on server restart, so "unused" means
+        # unused since the last mongod start
+        unused = []
+        try:
+            async for stat in collection.aggregate([{"$indexStats": {}}]):
+                if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                    unused.append(stat["name"])
+        except OperationFailure as e:
+            logger.warning(f"$indexStats not available for {collection_name}: {str(e)}")
+
+        report[collection_name] = {
+            "created": created,
+            "missing": [model.document["name"] for model in missing],
+            "failed": failed,
+            "present": sorted((existing | set(created)) & declared),
+            "unused": sorted(unused),
+            "undeclared": sorted(existing - declared - {"_id_"}),
+        }
+        if created or failed:
+            logger.info(f"Indexes on {collection_name}: created={created} failed={failed}")
+
+    index_report.clear()
+    index_report.update(report)
+    return report
+
+@api_router.get("/admin/indexes")
+async def get_index_report(refresh: bool = False, admin: User = Depends(get_admin_user)):
+    """Get the index reconciliation report (admin only)"""
+    if refresh or not index_report:
+        return await ensure_indexes()
+    return index_report
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=UPLOAD_MAX_REQUEST_BYTES, max_json_bytes=UPLOAD_MAX_JSON_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, RESULTS_TRUNCATED_HEADER],
 )
 
 # Configure logging
@@ -1377,6 +3786,52 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        # A failed reconciliation should never keep the API from starting
+        logger.error(f"Index reconciliation failed: {str(e)}")
+    
+    if FAST_JSON_RESPONSES and orjson is None:
+        logger.warning("FAST_JSON_RESPONSES is set but orjson is not installed; list endpoints use the validated path")
+    
+    background_tasks.append(asyncio.create_task(chat_feed.run()))
+    background_tasks.append(asyncio.create_task(chat_read_feed.run()))
+    background_tasks.append(asyncio.create_task(notification_feed.run()))
+    
+    background_tasks.append(asyncio.create_task(notification_outbox.run()))
+    background_tasks.append(asyncio.create_task(backfill_unread_counters()))
+    background_tasks.append(asyncio.create_task(run_stripe_event_worker()))
+    for _ in range(IMAGE_WORKERS):
+        background_tasks.append(asyncio.create_task(run_image_pipeline()))
+    background_tasks.append(asyncio.create_task(
+        run_periodically("expire_subscriptions", SUBSCRIPTION_SWEEP_SECONDS, expire_subscriptions)
+    ))
+    background_tasks.append(asyncio.create_task(
+        run_periodically("reconcile_platform_stats", PLATFORM_STATS_RECONCILE_SECONDS, reconcile_platform_stats)
+    ))
+    try:
+        stats = await db.platform_stats.find_one({"id": PLATFORM_STATS_ID}, {"_id": 0, "reconciled_at": 1})
+        if not stats or "reconciled_at" not in stats:
+            await reconcile_platform_stats()
+    except Exception as e:
+        logger.error(f"Initial platform stats reconcile failed: {str(e)}")
+    try:
+        queued = await requeue_pending_images()
+        if queued:
+            logger.info(f"Queued {queued} images for variant rendering")
+    except Exception as e:
+        logger.error(f"Could not queue pending images: {str(e)}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Write whatever the outbox still holds before the connection goes away
+    await notification_outbox.drain()
     client.close()
+    bcrypt_executor.shutdown(wait=False)
+    image_executor.shutdown(wait=False, cancel_futures=True)
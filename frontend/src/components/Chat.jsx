@@ -13,6 +13,9 @@ const Chat = ({ solicitudId, token, currentUserId }) => {
   const [sending, setSending] = useState(false);
   const messagesEndRef = useRef(null);
   const pollIntervalRef = useRef(null);
+  const socketRef = useRef(null);
+  const lastMessageRef = useRef(null);
+  const reconnectTimeoutRef = useRef(null);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -20,15 +23,22 @@ const Chat = ({ solicitudId, token, currentUserId }) => {
 
   const fetchMessages = async () => {
     try {
+      // After the first load only ask for messages newer than the last one we have
+      const last = lastMessageRef.current;
+      const params = last ? `?${new URLSearchParams({ since: last.created_at, after_id: last.id })}` : '';
       const response = await fetch(
-        `${process.env.REACT_APP_BACKEND_URL}/api/chat/messages/${solicitudId}`,
+        `${process.env.REACT_APP_BACKEND_URL}/api/chat/messages/${solicitudId}${params}`,
         {
           headers: { 'Authorization': `Bearer ${token}` }
         }
       );
       if (response.ok) {
         const data = await response.json();
-        setMessages(data);
+        if (last) {
+          data.forEach(addMessage);
+        } else {
+          setMessages(data);
+        }
       }
     } catch (error) {
       console.error('Error fetching messages:', error);
@@ -37,19 +47,95 @@ const Chat = ({ solicitudId, token, currentUserId }) => {
     }
   };
 
+  const addMessage = (message) => {
+    setMessages(prev => prev.some(m => m.id === message.id) ? prev : [...prev, message]);
+  };
+
+  const startPolling = () => {
+    if (!pollIntervalRef.current) {
+      pollIntervalRef.current = setInterval(fetchMessages, 5000);
+    }
+  };
+
+  const stopPolling = () => {
+    if (pollIntervalRef.current) {
+      clearInterval(pollIntervalRef.current);
+      pollIntervalRef.current = null;
+    }
+  };
+
   useEffect(() => {
+    let closed = false;
+    lastMessageRef.current = null;
+
+    // New messages are pushed over a WebSocket; while it is down we fall
+    // back to polling every 5 seconds and keep trying to reconnect. The
+    // socket URL carries a short-lived stream ticket, never the session
+    // token, so every attempt asks for a fresh one
+    const connect = async () => {
+      let ticket;
+      try {
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/auth/stream-ticket`, {
+          method: 'POST',
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        ticket = (await response.json()).ticket;
+      } catch (error) {
+        if (closed) return;
+        startPolling();
+        reconnectTimeoutRef.current = setTimeout(connect, 5000);
+        return;
+      }
+      if (closed) return;
+      const wsUrl = process.env.REACT_APP_BACKEND_URL.replace(/^http/, 'ws');
+      const socket = new WebSocket(`${wsUrl}/api/chat/ws/${solicitudId}?ticket=${encodeURIComponent(ticket)}`);
+      socketRef.current = socket;
+
+      socket.onopen = () => {
+        stopPolling();
+        // Catch up on anything sent while we were disconnected
+        fetchMessages();
+      };
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'message') {
+          addMessage(data.message);
+          // The chat is open, so a message pushed to us is read right away
+          if (data.message.receiver_id === currentUserId) {
+            socket.send(JSON.stringify({ type: 'read', last_read_at: data.message.created_at }));
+          }
+        } else if (data.type === 'read' && data.user_id !== currentUserId) {
+          setMessages(prev => prev.map(m =>
+            m.sender_id === currentUserId && m.created_at <= data.last_read_at ? { ...m, leido: true } : m
+          ));
+        }
+      };
+      socket.onclose = (event) => {
+        if (closed) return;
+        startPolling();
+        // 4401/4403/4404: no access to this chat, do not retry
+        if (event.code < 4400 || event.code >= 4500) {
+          reconnectTimeoutRef.current = setTimeout(connect, 5000);
+        }
+      };
+    };
+
     fetchMessages();
-    // Poll for new messages every 5 seconds
-    pollIntervalRef.current = setInterval(fetchMessages, 5000);
+    connect();
     
     return () => {
-      if (pollIntervalRef.current) {
-        clearInterval(pollIntervalRef.current);
+      closed = true;
+      stopPolling();
+      clearTimeout(reconnectTimeoutRef.current);
+      if (socketRef.current) {
+        socketRef.current.close();
       }
     };
   }, [solicitudId]);
 
   useEffect(() => {
+    lastMessageRef.current = messages.length ? messages[messages.length - 1] : null;
     scrollToBottom();
   }, [messages]);
 
@@ -76,7 +162,7 @@ const Chat = ({ solicitudId, token, currentUserId }) => {
 
       if (response.ok) {
         const data = await response.json();
-        setMessages(prev => [...prev, data]);
+        addMessage(data);
         setNewMessage('');
         
         if (data.warning) {
@@ -163,7 +163,7 @@ const LocationPicker = ({
     setOrigin(place.display_name);
     setOriginCoords(coords);
     setShowOriginSuggestions(false);
-    onOriginChange?.(place.display_name);
+    onOriginChange?.(place.display_name, coords);
     
     if (destinationCoords) {
       calculateRoute(coords, destinationCoords);
@@ -176,7 +176,7 @@ const LocationPicker = ({
     setDestination(place.display_name);
     setDestinationCoords(coords);
     setShowDestinationSuggestions(false);
-    onDestinationChange?.(place.display_name);
+    onDestinationChange?.(place.display_name, coords);
     
     if (originCoords) {
       calculateRoute(originCoords, coords);
@@ -30,10 +30,70 @@ const NotificationBell = ({ token }) => {
     }
   };
 
+  const upsertNotification = (notification) => {
+    setNotifications(prev => {
+      const others = prev.filter(n => n.id !== notification.id);
+      return [notification, ...others].sort((a, b) => b.created_at.localeCompare(a.created_at));
+    });
+  };
+
   useEffect(() => {
     fetchNotifications();
-    const interval = setInterval(fetchNotifications, 10000); // Poll every 10 seconds
-    return () => clearInterval(interval);
+
+    // Without EventSource support, fall back to polling every 10 seconds
+    if (typeof EventSource === 'undefined') {
+      const interval = setInterval(fetchNotifications, 10000);
+      return () => clearInterval(interval);
+    }
+
+    // The stream URL carries a short-lived ticket rather than the session
+    // token. The browser retries dropped connections on its own, but once
+    // the ticket has expired the retry is refused and the source closes;
+    // then we get a new ticket and resume from the last event we saw
+    let source = null;
+    let lastEventId = null;
+    let retryTimeout = null;
+    let closed = false;
+
+    const connect = async () => {
+      let ticket;
+      try {
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/auth/stream-ticket`, {
+          method: 'POST',
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        ticket = (await response.json()).ticket;
+      } catch (error) {
+        console.error('Error opening notification stream:', error);
+        if (!closed) retryTimeout = setTimeout(connect, 10000);
+        return;
+      }
+      if (closed) return;
+      const resume = lastEventId ? `&last_event_id=${encodeURIComponent(lastEventId)}` : '';
+      source = new EventSource(
+        `${process.env.REACT_APP_BACKEND_URL}/api/notifications/stream?ticket=${encodeURIComponent(ticket)}${resume}`
+      );
+      source.addEventListener('notification', (event) => {
+        if (event.lastEventId) lastEventId = event.lastEventId;
+        upsertNotification(JSON.parse(event.data));
+      });
+      source.addEventListener('unread', (event) => {
+        setUnreadCount(JSON.parse(event.data).notifications);
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED && !closed) {
+          retryTimeout = setTimeout(connect, 1000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimeout);
+      if (source) source.close();
+    };
   }, [token]);
 
   const markAsRead = async (notificationId) => {
@@ -154,6 +214,9 @@ const NotificationBell = ({ token }) => {
                 <div className="flex-1 min-w-0">
                   <p className={`text-sm ${notification.leida ? 'text-gray-600' : 'text-gray-900 font-medium'}`}>
                     {notification.titulo}
+                    {notification.count > 1 && (
+                      <span className="ml-1 text-xs text-blue-600">({notification.count})</span>
+                    )}
                   </p>
                   <p className="text-xs text-gray-500 truncate mt-0.5">
                     {notification.mensaje}
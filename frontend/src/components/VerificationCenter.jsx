@@ -34,6 +34,9 @@ const VerificationCenter = ({ token, userRoles }) => {
     foto_matricula: ''
   });
 
+  // Local preview URLs for the selected files, by field
+  const [previews, setPreviews] = useState({});
+
   const [submitting, setSubmitting] = useState(false);
 
   useEffect(() => {
@@ -68,16 +71,17 @@ const VerificationCenter = ({ token, userRoles }) => {
       return;
     }
 
-    const reader = new FileReader();
-    reader.onload = () => {
-      const base64 = reader.result;
-      if (formType === 'identity') {
-        setIdentityForm(prev => ({ ...prev, [field]: base64 }));
-      } else {
-        setVehicleForm(prev => ({ ...prev, [field]: base64 }));
-      }
-    };
-    reader.readAsDataURL(file);
+    // Files are sent as multipart uploads, so keep the File itself and only
+    // build an object URL for the preview
+    setPreviews(prev => {
+      if (prev[field]) URL.revokeObjectURL(prev[field]);
+      return { ...prev, [field]: URL.createObjectURL(file) };
+    });
+    if (formType === 'identity') {
+      setIdentityForm(prev => ({ ...prev, [field]: file }));
+    } else {
+      setVehicleForm(prev => ({ ...prev, [field]: file }));
+    }
   };
 
   const submitIdentityVerification = async () => {
@@ -88,18 +92,18 @@ const VerificationCenter = ({ token, userRoles }) => {
 
     setSubmitting(true);
     try {
-      const params = new URLSearchParams({
-        tipo_documento: identityForm.tipo_documento,
-        numero_documento: identityForm.numero_documento,
-        documento_imagen: identityForm.documento_imagen,
-        ...(identityForm.selfie_imagen && { selfie_imagen: identityForm.selfie_imagen })
-      });
+      const formData = new FormData();
+      formData.append('tipo_documento', identityForm.tipo_documento);
+      formData.append('numero_documento', identityForm.numero_documento);
+      formData.append('documento_imagen', identityForm.documento_imagen);
+      if (identityForm.selfie_imagen) formData.append('selfie_imagen', identityForm.selfie_imagen);
 
       const response = await fetch(
-        `${process.env.REACT_APP_BACKEND_URL}/api/verification/identity?${params}`,
+        `${process.env.REACT_APP_BACKEND_URL}/api/verification/identity/upload`,
         {
           method: 'POST',
-          headers: { 'Authorization': `Bearer ${token}` }
+          headers: { 'Authorization': `Bearer ${token}` },
+          body: formData
         }
       );
 
@@ -127,21 +131,21 @@ const VerificationCenter = ({ token, userRoles }) => {
 
     setSubmitting(true);
     try {
-      const params = new URLSearchParams({
-        tipo_vehiculo: vehicleForm.tipo_vehiculo,
-        marca: vehicleForm.marca,
-        modelo: vehicleForm.modelo,
-        ano: vehicleForm.ano.toString(),
-        matricula: vehicleForm.matricula,
-        foto_vehiculo: vehicleForm.foto_vehiculo,
-        foto_matricula: vehicleForm.foto_matricula
-      });
+      const formData = new FormData();
+      formData.append('tipo_vehiculo', vehicleForm.tipo_vehiculo);
+      formData.append('marca', vehicleForm.marca);
+      formData.append('modelo', vehicleForm.modelo);
+      formData.append('ano', vehicleForm.ano.toString());
+      formData.append('matricula', vehicleForm.matricula);
+      formData.append('foto_vehiculo', vehicleForm.foto_vehiculo);
+      formData.append('foto_matricula', vehicleForm.foto_matricula);
 
       const response = await fetch(
-        `${process.env.REACT_APP_BACKEND_URL}/api/verification/vehicle?${params}`,
+        `${process.env.REACT_APP_BACKEND_URL}/api/verification/vehicle/upload`,
         {
           method: 'POST',
-          headers: { 'Authorization': `Bearer ${token}` }
+          headers: { 'Authorization': `Bearer ${token}` },
+          body: formData
         }
       );
 
@@ -241,7 +245,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                     <div className="border-2 border-dashed rounded-lg p-4 text-center">
                       {identityForm.documento_imagen ? (
                         <div className="space-y-2">
-                          <img src={identityForm.documento_imagen} alt="Documento" className="max-h-32 mx-auto rounded" />
+                          <img src={previews.documento_imagen} alt="Documento" className="max-h-32 mx-auto rounded" />
                           <Button variant="outline" size="sm" onClick={() => setIdentityForm(prev => ({ ...prev, documento_imagen: '' }))}>
                             Cambiar imagen
                           </Button>
@@ -252,7 +256,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                           <p className="text-sm text-gray-500">Click para subir imagen</p>
                           <input
                             type="file"
-                            accept="image/*"
+                            accept="image/jpeg,image/png,image/webp"
                             className="hidden"
                             onChange={(e) => handleFileUpload(e, 'documento_imagen', 'identity')}
                           />
@@ -266,7 +270,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                     <div className="border-2 border-dashed rounded-lg p-4 text-center">
                       {identityForm.selfie_imagen ? (
                         <div className="space-y-2">
-                          <img src={identityForm.selfie_imagen} alt="Selfie" className="max-h-32 mx-auto rounded" />
+                          <img src={previews.selfie_imagen} alt="Selfie" className="max-h-32 mx-auto rounded" />
                           <Button variant="outline" size="sm" onClick={() => setIdentityForm(prev => ({ ...prev, selfie_imagen: '' }))}>
                             Cambiar imagen
                           </Button>
@@ -277,7 +281,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                           <p className="text-sm text-gray-500">Selfie con documento</p>
                           <input
                             type="file"
-                            accept="image/*"
+                            accept="image/jpeg,image/png,image/webp"
                             className="hidden"
                             onChange={(e) => handleFileUpload(e, 'selfie_imagen', 'identity')}
                           />
@@ -415,7 +419,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                       <div className="border-2 border-dashed rounded-lg p-3 text-center">
                         {vehicleForm.foto_vehiculo ? (
                           <div className="space-y-2">
-                            <img src={vehicleForm.foto_vehiculo} alt="Vehículo" className="max-h-20 mx-auto rounded" />
+                            <img src={previews.foto_vehiculo} alt="Vehículo" className="max-h-20 mx-auto rounded" />
                             <Button variant="outline" size="sm" onClick={() => setVehicleForm(prev => ({ ...prev, foto_vehiculo: '' }))}>
                               Cambiar
                             </Button>
@@ -426,7 +430,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                             <p className="text-xs text-gray-500">Subir foto</p>
                             <input
                               type="file"
-                              accept="image/*"
+                              accept="image/jpeg,image/png,image/webp"
                               className="hidden"
                               onChange={(e) => handleFileUpload(e, 'foto_vehiculo', 'vehicle')}
                             />
@@ -440,7 +444,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                       <div className="border-2 border-dashed rounded-lg p-3 text-center">
                         {vehicleForm.foto_matricula ? (
                           <div className="space-y-2">
-                            <img src={vehicleForm.foto_matricula} alt="Matrícula" className="max-h-20 mx-auto rounded" />
+                            <img src={previews.foto_matricula} alt="Matrícula" className="max-h-20 mx-auto rounded" />
                             <Button variant="outline" size="sm" onClick={() => setVehicleForm(prev => ({ ...prev, foto_matricula: '' }))}>
                               Cambiar
                             </Button>
@@ -451,7 +455,7 @@ const VerificationCenter = ({ token, userRoles }) => {
                             <p className="text-xs text-gray-500">Subir foto</p>
                             <input
                               type="file"
-                              accept="image/*"
+                              accept="image/jpeg,image/png,image/webp"
                               className="hidden"
                               onChange={(e) => handleFileUpload(e, 'foto_matricula', 'vehicle')}
                             />
@@ -19,6 +19,9 @@ const AdminDashboard = ({ user, token, onLogout }) => {
   const [stats, setStats] = useState(null);
   const [identityVerifications, setIdentityVerifications] = useState([]);
   const [vehicleVerifications, setVehicleVerifications] = useState([]);
+  const [identityCursor, setIdentityCursor] = useState(null);
+  const [vehicleCursor, setVehicleCursor] = useState(null);
+  const [loadingImages, setLoadingImages] = useState(false);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState('identity');
   const [selectedVerification, setSelectedVerification] = useState(null);
@@ -58,28 +61,36 @@ const AdminDashboard = ({ user, token, onLogout }) => {
     }
   };
 
-  const fetchIdentityVerifications = async () => {
+  const fetchIdentityVerifications = async (cursor = null) => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/verifications/identity?status=pending`, {
+      // Listings come without images; those are fetched when a row is opened
+      const params = new URLSearchParams({ status: 'pending' });
+      if (cursor) params.append('cursor', cursor);
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/verifications/identity?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       if (response.ok) {
         const data = await response.json();
-        setIdentityVerifications(data);
+        setIdentityVerifications(prev => cursor ? [...prev, ...data] : data);
+        setIdentityCursor(response.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Error fetching identity verifications:', error);
     }
   };
 
-  const fetchVehicleVerifications = async () => {
+  const fetchVehicleVerifications = async (cursor = null) => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/verifications/vehicle?status=pending`, {
+      // Listings come without images; those are fetched when a row is opened
+      const params = new URLSearchParams({ status: 'pending' });
+      if (cursor) params.append('cursor', cursor);
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/verifications/vehicle?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       if (response.ok) {
         const data = await response.json();
-        setVehicleVerifications(data);
+        setVehicleVerifications(prev => cursor ? [...prev, ...data] : data);
+        setVehicleCursor(response.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Error fetching vehicle verifications:', error);
@@ -123,10 +134,35 @@ const AdminDashboard = ({ user, token, onLogout }) => {
     }
   };
 
-  const openVerificationDetails = (verification, type) => {
+  // Stored images come back as /api/blobs/... paths, already signed by the
+  // backend for a few minutes since <img> cannot send the Authorization header
+  const imageSrc = (value) => (
+    value && value.startsWith('/api/')
+      ? `${process.env.REACT_APP_BACKEND_URL}${value}`
+      : value
+  );
+
+  const openVerificationDetails = async (verification, type) => {
     setSelectedVerification({ ...verification, type });
     setViewDialogOpen(true);
     setAdminNotes('');
+
+    setLoadingImages(true);
+    try {
+      const response = await fetch(
+        `${process.env.REACT_APP_BACKEND_URL}/api/admin/verifications/${type}/${verification.id}/images`,
+        { headers: { 'Authorization': `Bearer ${token}` } }
+      );
+      if (response.ok) {
+        const images = await response.json();
+        // Ignore late responses for a dialog that has moved on
+        setSelectedVerification(prev => (prev && prev.id === verification.id ? { ...prev, ...images } : prev));
+      }
+    } catch (error) {
+      console.error('Error fetching verification images:', error);
+    } finally {
+      setLoadingImages(false);
+    }
   };
 
   const formatDate = (dateString) => {
@@ -247,11 +283,11 @@ const AdminDashboard = ({ user, token, onLogout }) => {
               <TabsList className="grid w-full grid-cols-2 mb-6">
                 <TabsTrigger value="identity" className="flex items-center gap-2">
                   <Shield className="w-4 h-4" />
-                  Identidad ({identityVerifications.length})
+                  Identidad ({stats?.pending_identity_verifications ?? identityVerifications.length})
                 </TabsTrigger>
                 <TabsTrigger value="vehicle" className="flex items-center gap-2">
                   <Car className="w-4 h-4" />
-                  Vehículos ({vehicleVerifications.length})
+                  Vehículos ({stats?.pending_vehicle_verifications ?? vehicleVerifications.length})
                 </TabsTrigger>
               </TabsList>
 
@@ -270,9 +306,17 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                         className="flex items-center justify-between p-4 border rounded-lg hover:bg-gray-50"
                       >
                         <div className="flex items-center gap-4">
-                          <div className="w-12 h-12 bg-blue-100 rounded-full flex items-center justify-center">
-                            <Shield className="w-6 h-6 text-blue-600" />
-                          </div>
+                          {v.thumbnails?.documento_imagen ? (
+                            <img
+                              src={imageSrc(v.thumbnails.documento_imagen)}
+                              alt="Documento"
+                              className="w-12 h-12 rounded-lg object-cover border"
+                            />
+                          ) : (
+                            <div className="w-12 h-12 bg-blue-100 rounded-full flex items-center justify-center">
+                              <Shield className="w-6 h-6 text-blue-600" />
+                            </div>
+                          )}
                           <div>
                             <p className="font-medium">{v.user?.nombre || 'Usuario'}</p>
                             <p className="text-sm text-gray-500">{v.user?.email}</p>
@@ -296,6 +340,14 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                         </div>
                       </div>
                     ))}
+                    {identityCursor && (
+                      <Button
+                        variant="outline"
+                        onClick={() => fetchIdentityVerifications(identityCursor)}
+                      >
+                        Cargar más
+                      </Button>
+                    )}
                   </div>
                 )}
               </TabsContent>
@@ -315,9 +367,17 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                         className="flex items-center justify-between p-4 border rounded-lg hover:bg-gray-50"
                       >
                         <div className="flex items-center gap-4">
-                          <div className="w-12 h-12 bg-emerald-100 rounded-full flex items-center justify-center">
-                            <Car className="w-6 h-6 text-emerald-600" />
-                          </div>
+                          {v.thumbnails?.foto_vehiculo ? (
+                            <img
+                              src={imageSrc(v.thumbnails.foto_vehiculo)}
+                              alt="Vehículo"
+                              className="w-12 h-12 rounded-lg object-cover border"
+                            />
+                          ) : (
+                            <div className="w-12 h-12 bg-emerald-100 rounded-full flex items-center justify-center">
+                              <Car className="w-6 h-6 text-emerald-600" />
+                            </div>
+                          )}
                           <div>
                             <p className="font-medium">{v.user?.nombre || 'Usuario'}</p>
                             <p className="text-sm text-gray-500">
@@ -343,6 +403,14 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                         </div>
                       </div>
                     ))}
+                    {vehicleCursor && (
+                      <Button
+                        variant="outline"
+                        onClick={() => fetchVehicleVerifications(vehicleCursor)}
+                      >
+                        Cargar más
+                      </Button>
+                    )}
                   </div>
                 )}
               </TabsContent>
@@ -386,12 +454,12 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                     <h4 className="font-medium mb-2">Imagen del Documento</h4>
                     {selectedVerification.documento_imagen ? (
                       <img 
-                        src={selectedVerification.documento_imagen} 
+                        src={imageSrc(selectedVerification.documento_imagen)} 
                         alt="Documento" 
                         className="max-h-64 rounded-lg border"
                       />
                     ) : (
-                      <p className="text-gray-500">No se proporcionó imagen</p>
+                      <p className="text-gray-500">{loadingImages ? 'Cargando imagen...' : 'No se proporcionó imagen'}</p>
                     )}
                   </div>
 
@@ -399,7 +467,7 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                     <div>
                       <h4 className="font-medium mb-2">Selfie con Documento</h4>
                       <img 
-                        src={selectedVerification.selfie_imagen} 
+                        src={imageSrc(selectedVerification.selfie_imagen)} 
                         alt="Selfie" 
                         className="max-h-64 rounded-lg border"
                       />
@@ -427,24 +495,24 @@ const AdminDashboard = ({ user, token, onLogout }) => {
                       <h4 className="font-medium mb-2">Foto del Vehículo</h4>
                       {selectedVerification.foto_vehiculo ? (
                         <img 
-                          src={selectedVerification.foto_vehiculo} 
+                          src={imageSrc(selectedVerification.foto_vehiculo)} 
                           alt="Vehículo" 
                           className="max-h-40 rounded-lg border"
                         />
                       ) : (
-                        <p className="text-gray-500">No disponible</p>
+                        <p className="text-gray-500">{loadingImages ? 'Cargando...' : 'No disponible'}</p>
                       )}
                     </div>
                     <div>
                       <h4 className="font-medium mb-2">Foto de Matrícula</h4>
                       {selectedVerification.foto_matricula ? (
                         <img 
-                          src={selectedVerification.foto_matricula} 
+                          src={imageSrc(selectedVerification.foto_matricula)} 
                           alt="Matrícula" 
                           className="max-h-40 rounded-lg border"
                         />
                       ) : (
-                        <p className="text-gray-500">No disponible</p>
+                        <p className="text-gray-500">{loadingImages ? 'Cargando...' : 'No disponible'}</p>
                       )}
                     </div>
                   </div>
@@ -12,9 +12,13 @@ import { Plus, Package, MapPin, Clock, TrendingUp, User, LogOut, Route } from 'l
 import LocationPicker from '../components/LocationPicker';
 import NotificationBell from '../components/NotificationBell';
 
+// LocationPicker gives [lat, lon]; the API stores GeoJSON [lon, lat]
+const toGeoPoint = (coords) => (coords ? { type: 'Point', coordinates: [coords[1], coords[0]] } : null);
+
 const ClientDashboard = ({ user, token, onLogout }) => {
   const navigate = useNavigate();
   const [requests, setRequests] = useState([]);
+  const [requestsCursor, setRequestsCursor] = useState(null);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(false);
   const [openDialog, setOpenDialog] = useState(false);
@@ -24,6 +28,8 @@ const ClientDashboard = ({ user, token, onLogout }) => {
     descripcion: '',
     origen: '',
     destino: '',
+    origen_geo: null,
+    destino_geo: null,
     tipo_carga: '',
     precio_ofrecido: ''
   });
@@ -34,14 +40,17 @@ const ClientDashboard = ({ user, token, onLogout }) => {
     fetchStats();
   }, []);
 
-  const fetchRequests = async () => {
+  const fetchRequests = async (cursor = null) => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/requests/my-requests`, {
+      const params = new URLSearchParams();
+      if (cursor) params.append('cursor', cursor);
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/requests/my-requests?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       if (response.ok) {
         const data = await response.json();
-        setRequests(data);
+        setRequests(prev => cursor ? [...prev, ...data] : data);
+        setRequestsCursor(response.headers.get('X-Next-Cursor'));
       }
     } catch (error) {
       console.error('Error fetching requests:', error);
@@ -87,6 +96,8 @@ const ClientDashboard = ({ user, token, onLogout }) => {
           descripcion: '',
           origen: '',
           destino: '',
+          origen_geo: null,
+          destino_geo: null,
           tipo_carga: '',
           precio_ofrecido: ''
         });
@@ -264,8 +275,8 @@ const ClientDashboard = ({ user, token, onLogout }) => {
                   <LocationPicker
                     initialOrigin={formData.origen}
                     initialDestination={formData.destino}
-                    onOriginChange={(value) => setFormData({ ...formData, origen: value })}
-                    onDestinationChange={(value) => setFormData({ ...formData, destino: value })}
+                    onOriginChange={(value, coords) => setFormData(prev => ({ ...prev, origen: value, origen_geo: toGeoPoint(coords) }))}
+                    onDestinationChange={(value, coords) => setFormData(prev => ({ ...prev, destino: value, destino_geo: toGeoPoint(coords) }))}
                     onRouteInfoChange={setRouteInfo}
                   />
                 </div>
@@ -361,6 +372,15 @@ const ClientDashboard = ({ user, token, onLogout }) => {
               </Card>
             ))
           )}
+          {requestsCursor && (
+            <Button
+              variant="outline"
+              data-testid="load-more-my-requests"
+              onClick={() => fetchRequests(requestsCursor)}
+            >
+              Cargar más solicitudes
+            </Button>
+          )}
         </div>
       </div>
     </div>
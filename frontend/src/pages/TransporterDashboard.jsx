@@ -3,13 +3,18 @@ import { useNavigate } from 'react-router-dom';
 import { Button } from '../components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '../components/ui/card';
 import { Badge } from '../components/ui/badge';
+import { Input } from '../components/ui/input';
 import { toast } from 'sonner';
-import { Truck, MapPin, Package, TrendingUp, Clock, User, LogOut, CreditCard, Crown } from 'lucide-react';
+import { Truck, MapPin, Package, TrendingUp, Clock, User, LogOut, CreditCard, Crown, Search } from 'lucide-react';
 import NotificationBell from '../components/NotificationBell';
 
 const TransporterDashboard = ({ user, token, onLogout }) => {
   const navigate = useNavigate();
   const [availableRequests, setAvailableRequests] = useState([]);
+  const [requestsCursor, setRequestsCursor] = useState(null);
+  const [searchQuery, setSearchQuery] = useState('');
+  // Query of the list currently shown, so "load more" keeps paging the same search
+  const [activeSearch, setActiveSearch] = useState('');
   const [myOffers, setMyOffers] = useState([]);
   const [stats, setStats] = useState(null);
   const [activeTab, setActiveTab] = useState('disponibles');
@@ -64,22 +69,38 @@ const TransporterDashboard = ({ user, token, onLogout }) => {
     setLoadingSubscription(false);
   };
 
-  const fetchAvailableRequests = async () => {
+  const fetchAvailableRequests = async (cursor = null, search = activeSearch) => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/requests`, {
+      // Only open and in negotiation requests, one page at a time; with a
+      // search term the server ranks them by relevance
+      const params = new URLSearchParams([['estado', 'abierto'], ['estado', 'en_negociacion']]);
+      if (search) params.append('q', search);
+      if (cursor) params.append('cursor', cursor);
+      const path = search ? '/api/requests/search' : '/api/requests';
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}${path}?${params}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       if (response.ok) {
         const data = await response.json();
-        // Filter only open and in negotiation requests
-        const available = data.filter(r => ['abierto', 'en_negociacion'].includes(r.estado));
-        setAvailableRequests(available);
+        setAvailableRequests(prev => cursor ? [...prev, ...data] : data);
+        setRequestsCursor(response.headers.get('X-Next-Cursor'));
+        setActiveSearch(search);
       }
     } catch (error) {
       console.error('Error fetching requests:', error);
     }
   };
 
+  const handleSearch = (e) => {
+    e.preventDefault();
+    const search = searchQuery.trim();
+    if (search.length === 1) {
+      toast.error('Escribe al menos 2 caracteres');
+      return;
+    }
+    fetchAvailableRequests(null, search);
+  };
+
   const fetchMyOffers = async () => {
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/offers/my-offers`, {
@@ -282,6 +303,21 @@ const TransporterDashboard = ({ user, token, onLogout }) => {
         {/* Content */}
         {activeTab === 'disponibles' && (
           <div className="grid gap-4">
+            <form onSubmit={handleSearch} className="flex gap-2">
+              <div className="relative flex-1">
+                <Search className="w-4 h-4 text-gray-400 absolute left-3 top-1/2 -translate-y-1/2" />
+                <Input
+                  data-testid="search-requests-input"
+                  value={searchQuery}
+                  onChange={(e) => setSearchQuery(e.target.value)}
+                  placeholder="Buscar por título, ciudad o tipo de carga"
+                  className="pl-9"
+                />
+              </div>
+              <Button type="submit" variant="outline" data-testid="search-requests-button">
+                Buscar
+              </Button>
+            </form>
             {availableRequests.length === 0 ? (
               <Card className="border-0 shadow-md">
                 <CardContent className="py-12 text-center">
@@ -324,6 +360,15 @@ const TransporterDashboard = ({ user, token, onLogout }) => {
                 </Card>
               ))
             )}
+            {requestsCursor && (
+              <Button
+                variant="outline"
+                data-testid="load-more-requests"
+                onClick={() => fetchAvailableRequests(requestsCursor)}
+              >
+                Cargar más solicitudes
+              </Button>
+            )}
           </div>
         )}
 
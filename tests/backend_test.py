@@ -198,6 +198,29 @@ class TransportMarketplaceAPITester:
         )
         return success and isinstance(response, list)
 
+    def test_requests_pagination(self):
+        """Test page size limit and cursor validation on request listing"""
+        success, response = self.run_test(
+            "Get Requests Page (limit=1)",
+            "GET",
+            "requests",
+            200,
+            token=self.transportista_token,
+            params={"limit": 1, "estado": ["abierto", "en_negociacion"]}
+        )
+        if not (success and isinstance(response, list) and len(response) <= 1):
+            return False
+
+        success, _ = self.run_test(
+            "Get Requests With Invalid Cursor",
+            "GET",
+            "requests",
+            400,
+            token=self.transportista_token,
+            params={"cursor": "not-a-cursor"}
+        )
+        return success
+
     def test_get_my_requests(self):
         """Test getting my requests"""
         success, response = self.run_test(
@@ -302,6 +325,43 @@ class TransportMarketplaceAPITester:
         )
         return success
 
+    def test_accept_offer_twice(self):
+        """Test that a request cannot be accepted a second time"""
+        success, response = self.run_test(
+            "Accept Offer Again (should fail)",
+            "PATCH",
+            f"offers/{self.offer_id}/accept",
+            409,
+            token=self.cliente_token
+        )
+        return success
+
+    def test_offer_after_accept(self):
+        """Test that an accepted request takes no new offers and keeps its state"""
+        success, response = self.run_test(
+            "Create Offer on Accepted Request (should fail)",
+            "POST",
+            "offers",
+            400,
+            data={
+                "solicitud_id": self.request_id,
+                "precio_oferta": 200.00,
+                "mensaje": "Oferta tardía",
+                "tipo": "oferta"
+            },
+            token=self.dual_role_token
+        )
+        if not success:
+            return False
+        success, response = self.run_test(
+            "Accepted Request Keeps Its State",
+            "GET",
+            f"requests/{self.request_id}",
+            200,
+            token=self.cliente_token
+        )
+        return success and response.get('estado') == 'aceptado'
+
     def test_update_status_en_transito(self):
         """Test updating request status to en_transito"""
         success, response = self.run_test(
@@ -343,6 +403,23 @@ class TransportMarketplaceAPITester:
         )
         return success
 
+    def test_duplicate_rating(self):
+        """Test that the same transaction cannot be rated twice"""
+        success, response = self.run_test(
+            "Create Duplicate Rating (should fail)",
+            "POST",
+            "ratings",
+            400,
+            data={
+                "to_user_id": self.transportista_user['id'],
+                "solicitud_id": self.request_id,
+                "rating": 1,
+                "comentario": "Segunda valoración"
+            },
+            token=self.cliente_token
+        )
+        return success
+
     def test_get_user_ratings(self):
         """Test getting user ratings"""
         success, response = self.run_test(
@@ -486,6 +563,7 @@ def main():
         return 1
     
     tester.test_get_all_requests()
+    tester.test_requests_pagination()
     tester.test_get_my_requests()
     tester.test_get_request_detail()
 
@@ -502,6 +580,8 @@ def main():
     tester.test_get_my_offers()
     tester.test_reject_offer()
     tester.test_accept_offer()
+    tester.test_accept_offer_twice()
+    tester.test_offer_after_accept()
 
     # Status Update Tests
     print("\n" + "=" * 60)
@@ -517,6 +597,7 @@ def main():
     print("=" * 60)
     
     tester.test_create_rating()
+    tester.test_duplicate_rating()
     tester.test_get_user_ratings()
 
     # Dashboard Tests
@@ -0,0 +1,169 @@
+"""
+Benchmark for the chat contact filter.
+
+Compares the single-pass filter_external_contact in backend/server.py with
+the legacy implementation (11 patterns, each searched and then substituted)
+on realistic chat messages and on adversarial inputs that make the legacy
+patterns backtrack. Also compares the full results, (filtered text, blocked,
+set of reasons), and lists every message where they differ. Known
+differences are listed in KNOWN_DIFFERENCES.
+
+Usage: python tests/bench_contact_filter.py
+"""
+import os
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+
+from server import filter_external_contact  # noqa: E402
+
+
+def legacy_filter_external_contact(text: str) -> tuple:
+    """The filter as it was before the single-pass engine"""
+    blocked = False
+    reasons = []
+
+    phone_patterns = [
+        r'\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}[-.\s]?\d{0,4}',
+        r'\d{9,}',
+        r'\d{3}[-.\s]\d{3}[-.\s]\d{3,4}',
+    ]
+    for pattern in phone_patterns:
+        if re.search(pattern, text):
+            text = re.sub(pattern, '[NÚMERO OCULTO]', text)
+            blocked = True
+            reasons.append('número de teléfono')
+
+    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+    if re.search(email_pattern, text):
+        text = re.sub(email_pattern, '[EMAIL OCULTO]', text)
+        blocked = True
+        reasons.append('email')
+
+    social_patterns = [
+        (r'@[a-zA-Z0-9_]{3,}', 'usuario de red social'),
+        (r'(?:instagram|ig|insta)[\s:]*[a-zA-Z0-9._]+', 'Instagram'),
+        (r'(?:whatsapp|wsp|whats)[\s:]*[\d+]+', 'WhatsApp'),
+        (r'(?:telegram|tg)[\s:]*[a-zA-Z0-9_]+', 'Telegram'),
+        (r'(?:facebook|fb)[\s:./]*[a-zA-Z0-9.]+', 'Facebook'),
+        (r'(?:twitter|tw)[\s:./]*[a-zA-Z0-9_]+', 'Twitter'),
+    ]
+    for pattern, name in social_patterns:
+        if re.search(pattern, text, re.IGNORECASE):
+            text = re.sub(pattern, f'[{name.upper()} OCULTO]', text, flags=re.IGNORECASE)
+            blocked = True
+            reasons.append(name)
+
+    url_pattern = r'https?://[^\s]+'
+    if re.search(url_pattern, text):
+        text = re.sub(url_pattern, '[ENLACE OCULTO]', text)
+        blocked = True
+        reasons.append('enlace')
+
+    reason = ', '.join(set(reasons)) if reasons else None
+    return text, blocked, reason
+
+
+REALISTIC = [
+    "Hola, ¿a qué hora puedes pasar a recoger el sofá?",
+    "Perfecto, te espero el martes por la mañana en el portal.",
+    "Son dos cajas grandes y una lavadora, unos 120 kg en total.",
+    "Llámame al 612 345 678 y lo hablamos",
+    "Mi número es +34 612345678, escríbeme",
+    "Mándame un correo a transportes.garcia@gmail.com",
+    "Búscame en instagram: mudanzas_rapidas",
+    "Te paso mi whatsapp 600123123",
+    "Mira las fotos en https://example.com/fotos/sofa.jpg",
+    "Sígueme en @mudanzas_bcn para ver más trabajos",
+    "El precio final serían 85 euros con el IVA incluido.",
+    "Vale, nos vemos el 12 de marzo a las 10:30.",
+]
+
+# Mixed and overlapping contact data, where rule precedence matters
+PRECEDENCE = [
+    "ig: juan@gmail.com",
+    "whatsapp: +34600111222",
+    "whatsapp: +34 600 111 222",
+    "wsp 12345",
+    "juan600123123@gmail.com",
+    "escríbeme a maria.lopez@hotmail.es o al 612345678",
+    "tw: @pepe_mudanzas",
+    "fb.com/mudanzas.garcia",
+    "ig 600123123",
+    "Telegram: pepe_99",
+    "https://example.com/fotos/123456789.jpg",
+    "ig: juan600123123",
+]
+
+# Messages where the single-pass filter deliberately differs from the legacy
+# one, and why
+KNOWN_DIFFERENCES = {
+    # Legacy hid the digits inside the URL first and then replaced the URL
+    # up to the next space, leaving "[ENLACE OCULTO] OCULTO]jpg"
+    "https://example.com/fotos/123456789.jpg": "URL hidden whole; reason is only 'enlace'",
+    # Legacy hid the number first and the keyword rule then took the rest;
+    # here the handle (letters and digits) is hidden as one Instagram match
+    "ig: juan600123123": "one [INSTAGRAM OCULTO] instead of Instagram + number placeholders",
+}
+
+ADVERSARIAL = {
+    "long digit run": "1" * 5000,
+    "spaced digits": "1 2 " * 2500,
+    "long word without @": "a" * 5000,
+    "dotted word without tld": "x@" + "a." * 2500,
+    "repeated keywords": "ig " * 2500,
+    "long realistic message": " ".join(REALISTIC) * 20,
+}
+
+
+def full_result(fn, message):
+    text, blocked, reason = fn(message)
+    return text, blocked, set(reason.split(', ')) if reason else set()
+
+
+def bench(fn, messages, number):
+    return min(timeit.repeat(lambda: [fn(m) for m in messages], number=number, repeat=5)) / number
+
+
+def main():
+    print("=" * 60)
+    print("CONTACT FILTER BENCHMARK")
+    print("=" * 60)
+
+    corpus = REALISTIC + PRECEDENCE
+    disagreements = [
+        m for m in corpus
+        if full_result(filter_external_contact, m) != full_result(legacy_filter_external_contact, m)
+    ]
+    print(f"\nFull-result agreement on realistic + precedence corpus: "
+          f"{len(corpus) - len(disagreements)}/{len(corpus)}")
+    for message in disagreements:
+        note = KNOWN_DIFFERENCES.get(message, "UNEXPECTED")
+        print(f"  - differs ({note}): {message!r}")
+        print(f"      legacy:      {full_result(legacy_filter_external_contact, message)}")
+        print(f"      single-pass: {full_result(filter_external_contact, message)}")
+
+    print(f"\n{'case':<28}{'legacy (µs)':>14}{'single-pass (µs)':>18}{'speedup':>10}")
+    legacy = bench(legacy_filter_external_contact, REALISTIC, 200) * 1e6
+    single = bench(filter_external_contact, REALISTIC, 200) * 1e6
+    print(f"{'realistic corpus':<28}{legacy:>14.1f}{single:>18.1f}{legacy / single:>9.1f}x")
+
+    for name, message in ADVERSARIAL.items():
+        legacy = bench(legacy_filter_external_contact, [message], 3) * 1e6
+        single = bench(filter_external_contact, [message], 3) * 1e6
+        print(f"{name:<28}{legacy:>14.1f}{single:>18.1f}{legacy / single:>9.1f}x")
+
+    print("\nScaling with message length (single-pass, 'a' * n):")
+    for n in (1000, 2000, 4000, 8000):
+        elapsed = bench(filter_external_contact, ["a" * n], 3) * 1e6
+        print(f"  n={n:<6} {elapsed:>10.1f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Benchmark for the FAST_JSON_RESPONSES list path.
+
+Compares, per response size, what FastAPI does with a list endpoint's rows
+by default (validate every row against the response_model, dump it back to
+JSON-compatible Python, render with json.dumps) with json_rows in
+backend/server.py (render the projected rows directly with orjson). Also
+checks that both produce the same JSON, including for documents that lack
+optional fields (requests created without coordinates).
+
+Usage: python tests/bench_fast_json.py
+"""
+import asyncio
+import json
+import os
+import sys
+import timeit
+import uuid
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+os.environ["FAST_JSON_RESPONSES"] = "true"
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from server import Offer, TransportRequest, json_rows  # noqa: E402
+
+SIZES = (10, 100, 1000)
+
+
+def transport_request(i: int) -> dict:
+    row = {
+        "id": str(uuid.uuid4()),
+        "cliente_id": str(uuid.uuid4()),
+        "cliente_nombre": f"Cliente {i}",
+        "titulo": f"Mudanza de piso {i}",
+        "descripcion": "Sofá de tres plazas, dos cajas grandes y una lavadora. Tercer piso sin ascensor.",
+        "origen": "Calle Mayor 12, Madrid",
+        "destino": "Avenida Diagonal 340, Barcelona",
+        "origen_geo": {"type": "Point", "coordinates": [-3.7038, 40.4168]},
+        "destino_geo": {"type": "Point", "coordinates": [2.1734, 41.3851]},
+        "tipo_carga": "mudanza",
+        "precio_ofrecido": 150.0 + i,
+        "estado": "abierto",
+        "created_at": "2025-03-12T10:30:00.000000+00:00",
+    }
+    if i % 2:
+        # Created without coordinates: the document has no geo fields at all
+        del row["origen_geo"], row["destino_geo"]
+    return row
+
+
+def offer(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "solicitud_id": str(uuid.uuid4()),
+        "transportista_id": str(uuid.uuid4()),
+        "transportista_nombre": f"Transportista {i}",
+        "precio_oferta": 120.0 + i,
+        "mensaje": "Puedo pasar el martes por la mañana.",
+        "estado": "pendiente",
+        "tipo": "oferta",
+        "created_at": "2025-03-12T10:30:00.000000+00:00",
+    }
+
+
+def validated_path(loop, field, rows: list) -> bytes:
+    """What FastAPI does with a response_model=List[...] endpoint's return value"""
+    content = loop.run_until_complete(serialize_response(field=field, response_content=rows, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def fast_path(model, rows: list) -> bytes:
+    return json_rows(rows, model).body
+
+
+def bench(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main():
+    print("=" * 60)
+    print("FAST JSON RESPONSE BENCHMARK")
+    print("=" * 60)
+
+    loop = asyncio.new_event_loop()
+    for model, factory in ((TransportRequest, transport_request), (Offer, offer)):
+        field = create_response_field(name=f"Response_{model.__name__}", type_=List[model])
+        print(f"\n{model.__name__}")
+        print(f"{'rows':>6}{'validated (µs)':>16}{'orjson (µs)':>14}{'speedup':>10}{'saved/row (µs)':>16}  same JSON")
+        for size in SIZES:
+            rows = [factory(i) for i in range(size)]
+            same = json.loads(validated_path(loop, field, rows)) == json.loads(fast_path(model, rows))
+            number = max(1, 2000 // size)
+            validated = bench(lambda: validated_path(loop, field, rows), number) * 1e6
+            fast = bench(lambda: fast_path(model, rows), number) * 1e6
+            print(f"{size:>6}{validated:>16.1f}{fast:>14.1f}{validated / fast:>9.1f}x"
+                  f"{(validated - fast) / size:>16.2f}  {'yes' if same else 'NO'}")
+    loop.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())